@@ -3,21 +3,26 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import subprocess
 import os
-import sys
 import threading
+import queue
 import platform
-import wave
 import struct
 import math
 
-# 核心脚本文件名 (必须与实际保存的文件名一致)
-CORE_SCRIPT_NAME = "smpte_noise.py"
+# 核心生成模块 (smpte_noise.py, 必须与本文件位于同一目录)
+import smpte_noise
+import smpte_peaks
+import smpte_daemon
+
+
+class GenerationCancelled(Exception):
+    """用户取消生成时在工作线程中抛出"""
 
 class PinkNoiseApp:
     def __init__(self, root):
         self.root = root
         self.root.title("SMPTE ST 2095-1 Pink Noise Generator")
-        self.root.geometry("520x600") # 增加高度以容纳统计信息
+        self.root.geometry("520x640") # 增加高度以容纳统计信息和进度条
         
         # 样式设置
         style = ttk.Style()
@@ -68,30 +73,52 @@ class PinkNoiseApp:
         # --- 分割线 ---
         ttk.Separator(main_frame, orient='horizontal').grid(row=5, column=0, columnspan=2, sticky="ew", pady=15)
 
-        # --- 生成按钮 ---
-        self.generate_btn = ttk.Button(main_frame, text="Generate Audio", command=self.start_generation_thread)
-        self.generate_btn.grid(row=6, column=0, columnspan=2, pady=(5, 5))
+        # --- 生成 / 取消按钮 ---
+        btn_frame = ttk.Frame(main_frame)
+        btn_frame.grid(row=6, column=0, columnspan=2, pady=(5, 5))
+        self.generate_btn = ttk.Button(btn_frame, text="Generate Audio", command=self.start_generation_thread)
+        self.generate_btn.pack(side=tk.LEFT, padx=5)
+        self.cancel_btn = ttk.Button(btn_frame, text="Cancel", command=self.cancel_generation, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=5)
+        # 提交给常驻生成服务 (smpte_daemon.py), 而不是在本进程中生成
+        self.use_daemon_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(btn_frame, text="Use daemon (port {0})".format(smpte_daemon.defaultPort),
+                        variable=self.use_daemon_var).pack(side=tk.LEFT, padx=5)
+
+        # --- 进度条 ---
+        self.progress_var = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(main_frame, variable=self.progress_var, maximum=100.0, length=480).grid(row=7, column=0, columnspan=2, pady=5)
 
         # --- 打开文件夹按钮 ---
         self.open_folder_btn = ttk.Button(main_frame, text="Open Output Folder", command=self.open_current_folder, state=tk.DISABLED)
-        self.open_folder_btn.grid(row=7, column=0, columnspan=2, pady=5)
+        self.open_folder_btn.grid(row=8, column=0, columnspan=2, pady=5)
 
         # --- 结果统计显示 (新增功能) ---
         self.result_stats_var = tk.StringVar(value="Measurement: --")
         self.stats_label = ttk.Label(main_frame, textvariable=self.result_stats_var, style='Result.TLabel')
-        self.stats_label.grid(row=8, column=0, columnspan=2, pady=(10, 0))
+        self.stats_label.grid(row=9, column=0, columnspan=2, pady=(10, 0))
 
         # --- 波形画布 ---
         self.canvas_width = 480
         self.canvas_height = 80
         self.waveform_canvas = tk.Canvas(main_frame, width=self.canvas_width, height=self.canvas_height, bg="#f0f0f0", highlightthickness=1, highlightbackground="#cccccc")
-        self.waveform_canvas.grid(row=9, column=0, columnspan=2, pady=(5, 10))
+        self.waveform_canvas.grid(row=10, column=0, columnspan=2, pady=(5, 10))
         # 占位符文本
         self.waveform_text = self.waveform_canvas.create_text(self.canvas_width//2, self.canvas_height//2, text="Waveform Preview", fill="gray")
+        # 峰值金字塔及当前视图范围 (样本), 滚轮缩放
+        self.peaks = None
+        self.view = (0, 0)
+        self.waveform_canvas.bind("<MouseWheel>", self.zoom_waveform)
+        self.waveform_canvas.bind("<Button-4>", self.zoom_waveform)
+        self.waveform_canvas.bind("<Button-5>", self.zoom_waveform)
 
         # --- 底部状态栏 ---
         self.status_var = tk.StringVar(value="Ready")
-        ttk.Label(main_frame, textvariable=self.status_var, foreground="gray").grid(row=10, column=0, columnspan=2, pady=5)
+        ttk.Label(main_frame, textvariable=self.status_var, foreground="gray").grid(row=11, column=0, columnspan=2, pady=5)
+
+        # 工作线程与界面之间的消息队列 (Tk 只能在主线程中操作)
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
 
     def select_directory(self):
         directory = filedialog.askdirectory()
@@ -115,160 +142,231 @@ class PinkNoiseApp:
         except Exception as e:
             messagebox.showerror("Error", f"Could not open folder: {e}")
 
-    def draw_waveform(self, file_path):
-        """读取 WAV 文件并在画布上绘制简化波形"""
-        self.waveform_canvas.delete("all") 
+    def draw_waveform(self, file_path, peaks=None):
+        """显示 WAV 文件的峰值包络 (min/max/RMS)
+
+        生成时构建的峰值金字塔可直接传入; 否则读取 .peaks 附属文件,
+        没有附属文件时才读取一次音频数据.
+        """
+        self.waveform_canvas.delete("all")
         self.waveform_canvas.create_text(self.canvas_width//2, self.canvas_height//2, text="Loading...", fill="gray")
-        self.root.update_idletasks() 
+        self.root.update_idletasks()
 
         try:
-            with wave.open(file_path, 'rb') as wf:
-                n_channels = wf.getnchannels()
-                framerate = wf.getframerate()
-                n_frames = wf.getnframes()
-                sampwidth = wf.getsampwidth()
-                
-                # 降采样步长
-                step = max(1, n_frames // self.canvas_width)
-                
-                center_y = self.canvas_height / 2
-                max_height = self.canvas_height / 2 - 2
-                
-                points = []
-                
-                # 限制预览读取量 (前30秒)
-                frames_to_read = min(n_frames, framerate * 30) 
-                
-                raw_bytes = wf.readframes(frames_to_read)
-                
-                self.waveform_canvas.delete("all")
-                
-                # 绘制中心线
-                self.waveform_canvas.create_line(0, center_y, self.canvas_width, center_y, fill="#dddddd")
-
-                for x in range(0, self.canvas_width):
-                    frame_index = int(x * step)
-                    if frame_index >= frames_to_read:
-                        break
-                        
-                    byte_index = frame_index * sampwidth * n_channels
-                    
-                    if byte_index + sampwidth > len(raw_bytes):
-                        break
-
-                    sample_bytes = raw_bytes[byte_index : byte_index + sampwidth]
-                    
-                    val = 0
-                    if sampwidth == 3: # 24-bit
-                        val = int.from_bytes(sample_bytes, byteorder='little', signed=True)
-                        max_val = 2**23 - 1
-                    elif sampwidth == 2: # 16-bit
-                        val = int.from_bytes(sample_bytes, byteorder='little', signed=True)
-                        max_val = 2**15 - 1
-                    elif sampwidth == 1: # 8-bit
-                        val = int.from_bytes(sample_bytes, byteorder='little', signed=False) - 128
-                        max_val = 127
-                    else:
-                        continue 
-
-                    normalized_h = (val / max_val) * max_height
-                    points.append(x)
-                    points.append(center_y - normalized_h)
-                
-                if len(points) > 2:
-                    # 绘制波形 (SMPTE Pink 风格颜色)
-                    self.waveform_canvas.create_line(points, fill="#FF0080", width=1)
-                    
+            if peaks is None:
+                peaks = smpte_peaks.load_peaks(file_path)
+            self.peaks = peaks
+            self.view = (0, peaks.count)
+            self.render_envelope()
         except Exception as e:
             print(f"Waveform error: {e}")
+            self.peaks = None
             self.waveform_canvas.delete("all")
             self.waveform_canvas.create_text(self.canvas_width//2, self.canvas_height//2, text="Preview unavailable", fill="red")
 
-    def start_generation_thread(self):
-        t = threading.Thread(target=self.generate_noise)
-        t.start()
+    def render_envelope(self):
+        """按当前视图范围绘制包络, 耗时只与画布宽度有关"""
+        start, stop = self.view
+        columns = self.peaks.envelope(start, stop, self.canvas_width)
+
+        center_y = self.canvas_height / 2
+        max_height = self.canvas_height / 2 - 2
+
+        self.waveform_canvas.delete("all")
+
+        # 绘制中心线
+        self.waveform_canvas.create_line(0, center_y, self.canvas_width, center_y, fill="#dddddd")
+
+        if len(columns) > 1:
+            # 峰值包络: 上沿为最大值, 下沿为最小值 (SMPTE Pink 风格颜色)
+            upper = []
+            lower = []
+            rms_upper = []
+            rms_lower = []
+            for x, (low, high, rms) in enumerate(columns):
+                upper += [x, center_y - high * max_height]
+                lower += [x, center_y - low * max_height]
+                rms_upper += [x, center_y - rms * max_height]
+                rms_lower += [x, center_y + rms * max_height]
+            self.waveform_canvas.create_polygon(upper + self.reverse_points(lower), fill="#FF0080", outline="#FF0080")
+            self.waveform_canvas.create_polygon(rms_upper + self.reverse_points(rms_lower), fill="#99004d", outline="#99004d")
 
-    def generate_noise(self):
-        # 1. 验证
+        # 显示当前视图的时间范围
+        rate = float(self.peaks.SampleRate)
+        self.waveform_canvas.create_text(4, 2, anchor=tk.NW, fill="gray",
+                                         text=f"{start / rate:0.2f} s - {stop / rate:0.2f} s")
+
+    @staticmethod
+    def reverse_points(points):
+        """将 [x0, y0, x1, y1, ...] 按点反序"""
+        pairs = [points[i:i + 2] for i in range(0, len(points), 2)]
+        return [v for pair in reversed(pairs) for v in pair]
+
+    def zoom_waveform(self, event):
+        """鼠标滚轮缩放 (以鼠标位置为中心), 直接使用峰值金字塔, 不重新读取音频"""
+        if self.peaks is None:
+            return
+        zoom_in = getattr(event, "delta", 0) > 0 or getattr(event, "num", 0) == 4
+        start, stop = self.view
+        span = stop - start
+        anchor = start + span * min(max(event.x, 0), self.canvas_width) // self.canvas_width
+        new_span = span // 2 if zoom_in else span * 2
+        new_span = min(max(new_span, self.canvas_width), self.peaks.count)
+        start = anchor - (anchor - start) * new_span // span
+        start = min(max(start, 0), self.peaks.count - new_span)
+        self.view = (start, start + new_span)
+        self.render_envelope()
+
+    def start_generation_thread(self):
+        # 1. 验证 (在主线程中完成, 可以直接弹窗)
         try:
             duration = int(self.duration_var.get())
             channels = int(self.channel_var.get())
-            filename = self.filename_var.get().strip()
-            output_dir = self.output_dir_var.get()
-            
-            if not filename:
-                messagebox.showerror("Error", "Please enter a filename.")
-                return
-            
-            if not filename.lower().endswith(".wav"):
-                filename += ".wav"
-                
-            full_output_path = os.path.join(output_dir, filename)
-            
         except ValueError:
             messagebox.showerror("Error", "Duration and Channel Count must be integers.")
             return
 
-        # 2. 检查脚本
-        if not os.path.exists(CORE_SCRIPT_NAME):
-            messagebox.showerror("Error", f"Core script not found: {CORE_SCRIPT_NAME}\nPlease ensure the original code is saved with this name in the same directory.")
+        filename = self.filename_var.get().strip()
+        output_dir = self.output_dir_var.get()
+
+        if not filename:
+            messagebox.showerror("Error", "Please enter a filename.")
             return
 
-        # 3. 构建命令
-        cmd = [sys.executable, CORE_SCRIPT_NAME]
-        
-        if self.samplerate_var.get() == "96000":
-            cmd.append("-9")
-        
-        cmd.append("-d")
-        cmd.append(str(duration))
-        cmd.append("-c")
-        cmd.append(str(channels))
-        cmd.append(full_output_path)
+        if not filename.lower().endswith(".wav"):
+            filename += ".wav"
+
+        full_output_path = os.path.join(output_dir, filename)
+        sample_rate = int(self.samplerate_var.get())
 
-        # 4. 执行
+        # 2. 更新界面状态
         self.status_var.set("Generating, please wait...")
         self.result_stats_var.set("Generating...") # 重置统计显示
+        self.progress_var.set(0.0)
         self.waveform_canvas.delete("all")
         self.waveform_canvas.create_text(self.canvas_width//2, self.canvas_height//2, text="Generating...", fill="blue")
-        
+
         self.generate_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
         self.open_folder_btn.config(state=tk.DISABLED)
-        
+
+        # 3. 在工作线程中直接调用生成器 (不再启动子进程)
+        self.cancel_event.clear()
+        target = self.submit_to_daemon if self.use_daemon_var.get() else self.generate_noise
+        t = threading.Thread(target=target,
+                             args=(full_output_path, sample_rate, duration, channels))
+        t.daemon = True
+        t.start()
+        self.root.after(100, self.poll_events, filename, full_output_path)
+
+    def cancel_generation(self):
+        self.cancel_event.set()
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.status_var.set("Cancelling...")
+
+    def generate_noise(self, full_output_path, sample_rate, duration, channels):
+        """工作线程: 只通过队列与界面通信, 不直接操作 Tk"""
+        def on_progress(event):
+            if self.cancel_event.is_set():
+                raise GenerationCancelled()
+            self.events.put(("progress", event["fraction"]))
+
+        try:
+            monitor = smpte_noise.Monitor(on_progress, interval=0.1)
+            # 生成过程中同时构建峰值金字塔, 预览时无需重新读取文件
+            peaks = smpte_peaks.PeakPyramid(sample_rate, channels)
+            stats = smpte_noise.write_wav(full_output_path, sample_rate=sample_rate, duration=duration,
+                                          channels=channels, monitor=monitor, taps=[peaks])
+            self.events.put(("done", (stats, peaks)))
+        except GenerationCancelled:
+            self.remove_partial_file(full_output_path)
+            self.events.put(("cancelled", None))
+        except Exception as e:
+            self.remove_partial_file(full_output_path)
+            self.events.put(("error", str(e)))
+
+    def submit_to_daemon(self, full_output_path, sample_rate, duration, channels):
+        """工作线程: 把任务提交给常驻生成服务, 并转发其进度
+
+        服务同时写出 .peaks 附属文件, 预览时直接读取. 取消时断开连接,
+        服务会中止任务并删除未完成的文件.
+        """
+        def on_event(event):
+            if self.cancel_event.is_set():
+                raise GenerationCancelled()
+            if event["event"] == "progress":
+                self.events.put(("progress", event["fraction"]))
+
+        job = {"path": os.path.abspath(full_output_path), "sample_rate": sample_rate,
+               "duration": duration, "channels": channels, "peaks": True}
         try:
-            # 捕获输出
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
-            
-            if result.returncode == 0:
+            result = smpte_daemon.submit(job, callback=on_event)
+            if result["event"] == "done":
+                stats = smpte_noise.NoiseStats(sample_rate)
+                stats.accum = result["accum"]
+                stats.count = result["count"]
+                self.events.put(("done", (stats, None)))
+            elif result["event"] == "cancelled":
+                self.events.put(("cancelled", None))
+            else:
+                self.events.put(("error", result["message"]))
+        except GenerationCancelled:
+            self.events.put(("cancelled", None))
+        except OSError as e:
+            self.events.put(("error", "Generation daemon unavailable: {0}".format(e)))
+        except Exception as e:
+            self.events.put(("error", str(e)))
+
+    def remove_partial_file(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+    def poll_events(self, filename, full_output_path):
+        """主线程: 通过 root.after 定时处理工作线程发来的消息"""
+        while True:
+            try:
+                kind, value = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "progress":
+                self.progress_var.set(value * 100.0)
+                continue
+
+            self.generate_btn.config(state=tk.NORMAL)
+            self.cancel_btn.config(state=tk.DISABLED)
+
+            if kind == "done":
+                stats, peaks = value
+                self.progress_var.set(100.0)
                 self.status_var.set(f"Success: {filename}")
                 self.open_folder_btn.config(state=tk.NORMAL)
-                
-                # --- 提取并显示 RMS ---
-                output_text = result.stdout.strip()
-                # 原始脚本输出通常是: "10.00 seconds, RMS (dB) = -21.50"
-                # 我们尝试直接显示这行文字，或者提取其中的数值部分
-                if "RMS (dB)" in output_text:
-                    self.result_stats_var.set(output_text) # 直接显示脚本返回的统计行
-                else:
-                    self.result_stats_var.set("Measured RMS: (Check Popup)")
+
+                # --- 显示 RMS (直接使用生成器返回的统计数据) ---
+                output_text = "{0:0.2f} seconds, RMS (dB) = {1:2.2f}".format(stats.seconds(), stats.rms_db())
+                self.result_stats_var.set(output_text)
 
                 # 绘制波形和弹窗
-                self.root.after(0, lambda: self.draw_waveform(full_output_path))
-                self.root.after(0, lambda: messagebox.showinfo("Success", f"Generation Complete!\nFile: {filename}\n\n{output_text}"))
-                
+                self.draw_waveform(full_output_path, peaks)
+                messagebox.showinfo("Success", f"Generation Complete!\nFile: {filename}\n\n{output_text}")
+
+            elif kind == "cancelled":
+                self.progress_var.set(0.0)
+                self.status_var.set("Generation Cancelled")
+                self.result_stats_var.set("Measurement: --")
+                self.waveform_canvas.delete("all")
+
             else:
-                messagebox.showerror("Generation Failed", f"Script Error:\n{result.stderr}")
+                messagebox.showerror("Generation Failed", f"Error:\n{value}")
                 self.status_var.set("Generation Failed")
                 self.result_stats_var.set("Error")
                 self.waveform_canvas.delete("all")
-                
-        except Exception as e:
-            messagebox.showerror("System Error", str(e))
-            self.status_var.set("System Error")
-            self.result_stats_var.set("Error")
-            self.waveform_canvas.delete("all")
-        finally:
-            self.generate_btn.config(state=tk.NORMAL)
+            return
+
+        self.root.after(100, self.poll_events, filename, full_output_path)
 
 if __name__ == "__main__":
     root = tk.Tk()
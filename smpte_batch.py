@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Render a matrix of ST 2095-1 noise files in one run.
+#
+# Every file at a given sample rate starts with the same mono samples and
+# differs only in its length and in how often each sample is repeated
+# across channels. The jobs of a manifest are therefore grouped by sample
+# rate; each group generates its mono stream once, as long as its longest
+# file, interleaves every block once per channel count and writes it to
+# all files that are not yet complete. The groups run in a pool of worker
+# processes, one per sample rate.
+#
+# A manifest is a JSON list of jobs, e.g.
+#
+#   [{"path": "a.wav", "sample_rate": 48000, "duration": 60, "channels": 2}, ...]
+#
+# a JSON matrix, which expands to every combination,
+#
+#   {"rates": [48000, 96000], "durations": [10, 30, 60, 300, 3600],
+#    "channels": [1, 2, 6, 8, 16], "pattern": "pink_{khz}k_{duration}s_{channels}ch.wav"}
+#
+# or a CSV file with the columns path, sample_rate, duration, channels.
+#
+
+import os
+import csv
+import json
+import time
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor
+
+import smpte_noise
+
+
+def _job(path, sample_rate=48000, duration=10, channels=1, raw=False):
+    job = {"path": path, "sample_rate": int(sample_rate), "duration": int(duration),
+           "channels": int(channels), "raw": raw in (True, "1", "true", "yes")}
+    if job["sample_rate"] not in (48000, 96000) or job["duration"] < 0 or job["channels"] < 1:
+        raise ValueError("Invalid job: {0}".format(job))
+    return job
+
+
+# Read a JSON or CSV manifest. Relative paths are taken relative to
+# `directory`.
+def load_manifest(path, directory=""):
+    with open(path) as reader:
+        if path.lower().endswith(".csv"):
+            jobs = [_job(**row) for row in csv.DictReader(reader)]
+        else:
+            manifest = json.load(reader)
+            if isinstance(manifest, dict):
+                jobs = [_job(manifest["pattern"].format(rate=rate, khz=rate // 1000, duration=duration,
+                                                        channels=channels),
+                             rate, duration, channels, manifest.get("raw", False))
+                        for rate in manifest["rates"]
+                        for duration in manifest["durations"]
+                        for channels in manifest["channels"]]
+            else:
+                jobs = [_job(**job) for job in manifest]
+    for job in jobs:
+        job["path"] = os.path.join(directory, job["path"])
+    return jobs
+
+
+# Render all jobs of one sample rate from a single mono stream. Returns a
+# list of (path, accum, count) statistics.
+def render_group(sampleRate, jobs, engine=None):
+    config = smpte_noise.get_config(sampleRate)
+    targets = []
+    try:
+        for job in jobs:
+            writer = open(job["path"], "wb")
+            targets.append((job, writer, config.output_periods(job["duration"]) * config.samplesPerPeriod))
+            if not job["raw"]:
+                writer.write(smpte_noise.wave_header(config, job["channels"],
+                                                     smpte_noise.data_length(config, job["duration"],
+                                                                             job["channels"])))
+
+        periods = max(config.output_periods(job["duration"]) for job in jobs)
+        stats = smpte_noise.NoiseStats(sampleRate)
+        results = []
+        done = 0
+        for chunk in smpte_noise.ENGINES[engine or smpte_noise.default_engine()](config, periods, 1, stats):
+            active = [target for target in targets if target[2] > done]
+            frames = {}
+            for job, writer, samples in active:
+                channels = job["channels"]
+                if channels not in frames:
+                    frames[channels] = smpte_noise.interleave(chunk, channels)
+                writer.write(frames[channels])
+            done += len(chunk) // smpte_noise.sampleSize
+            for job, writer, samples in active:
+                if samples == done:
+                    writer.close()
+                    results.append((job["path"], stats.accum, stats.count))
+        return results
+    finally:
+        for job, writer, samples in targets:
+            writer.close()
+
+
+# Render every job, with up to `jobs` worker processes (one per sample rate).
+def run(manifest, jobs=None, engine=None):
+    groups = {}
+    for job in manifest:
+        groups.setdefault(job["sample_rate"], []).append(job)
+    workers = max(1, min(jobs or len(groups), len(groups)))
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(render_group, sampleRate, group, engine)
+                   for sampleRate, group in sorted(groups.items())]
+        results = []
+        for (sampleRate, group), future in zip(sorted(groups.items()), futures):
+            for path, accum, count in future.result():
+                stats = smpte_noise.NoiseStats(sampleRate)
+                stats.accum = accum
+                stats.count = count
+                results.append((path, stats))
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog [options] <manifest.json|manifest.csv>""",
+                          description="Render a matrix of ST 2095-1 pink noise files, generating each sample "
+                                      "rate only once.")
+    parser.add_option('-j', '--jobs', action='store', dest='Jobs', type="int", default=None, metavar='<n>',
+                      help="Number of worker processes (default: one per sample rate)")
+    parser.add_option('-e', '--engine', action='store', dest='Engine', type="choice",
+                      choices=sorted(smpte_noise.ENGINES), default=None, metavar='<name>',
+                      help="Generator engine (default: " + smpte_noise.default_engine() + ")")
+    parser.add_option('-o', '--output-dir', action='store', dest='Directory', default="", metavar='<dir>',
+                      help="Directory for relative output paths (default: current directory)")
+    parser.add_option('-q', '--quiet', action='store_false', dest='VerboseFlag', default=True,
+                      help="Suppress output of statistics to stdout")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("Manifest filename required.")
+
+    try:
+        manifest = load_manifest(args[0], options.Directory)
+    except (KeyError, TypeError, ValueError) as e:
+        parser.error("Invalid manifest: {0}".format(e))
+
+    start = time.perf_counter()
+    results = run(manifest, options.Jobs, options.Engine)
+    if options.VerboseFlag:
+        for path, stats in results:
+            print("{0}: {1:0.2f} seconds, RMS (dB) = {2:2.2f}".format(path, stats.seconds(), stats.rms_db()))
+        print("{0} files in {1:0.2f} seconds".format(len(results), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+#
+# Throughput benchmarks for the ST 2095-1 noise generator.
+#
+# Measures samples/sec and MB/s of each pipeline stage (including the peak
+# envelope used by the GUI preview) and of each engine writing complete
+# files, for both sample rates and a range of channel counts and
+# durations. Each stage is timed several times and the best run is kept,
+# so that a single slow run does not fail a baseline comparison. Every
+# engine case runs in a fresh process forked from a server started before
+# any benchmark work, so that its peak RSS is its own, and with a cache
+# directory of its own: it is timed once on the empty ("cold") directory
+# and once more on what the first run left there ("warm"). The output of
+# each engine is also compared with the reference loop.
+#
+# Results are written as JSON; with --baseline the run fails when a case
+# is slower than the stored result by more than the tolerance, or when an
+# engine that was bit-exact no longer is.
+#
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import platform
+import multiprocessing
+from optparse import OptionParser
+
+import smpte_noise
+import smpte_peaks
+
+try:
+    import resource
+except ImportError:
+    resource = None     # not available on Windows
+
+
+# Peak resident set size of this process in bytes, or None. VmHWM covers
+# only the current address space; on Linux ru_maxrss keeps the high-water
+# mark of the parent across fork and exec.
+def peak_rss():
+    try:
+        with open("/proc/self/status") as reader:
+            for line in reader:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss          # bytes on macOS
+    return rss * 1024       # kilobytes elsewhere
+
+
+# Restart VmHWM from the current resident set size (Linux only).
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as writer:
+            writer.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def _case(kind, name, sampleRate, seconds, frames, nbytes, channels=1, duration=None):
+    return {
+        "kind": kind,
+        "name": name,
+        "sample_rate": sampleRate,
+        "channels": channels,
+        "duration": duration,
+        "seconds": seconds,
+        "samples_per_sec": frames / seconds if seconds else None,
+        "mb_per_sec": nbytes / seconds / 1e6 if seconds and nbytes else None,
+    }
+
+
+# Time each pipeline stage separately over `count` samples, keeping the
+# best of `repeat` runs.
+def bench_stages(sampleRate, channelCounts, count, repeat=5):
+    config = smpte_noise.get_config(sampleRate)
+    results = []
+
+    def timed(name, func, nbytes=0, channels=1):
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            out = func()
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best = seconds
+        results.append(_case("stage", name, sampleRate, best, count, nbytes, channels))
+        return out
+
+    white = timed("prng", lambda: list(smpte_noise.prng_stage(config, count)))
+    pink = timed("pink", lambda: list(smpte_noise.pink_stage(iter(white))))
+    band = timed("bandpass", lambda: list(smpte_noise.bandpass_stage(config, iter(pink))))
+    clipped = timed("clip", lambda: list(smpte_noise.clip_stage(config, iter(band))))
+
+    for channels in channelCounts:
+        nbytes = count * smpte_noise.sampleSize * channels
+        packed = timed("pack", lambda: [smpte_noise.pack_samples(block, channels) for block in clipped],
+                       nbytes, channels)
+        if smpte_noise.numpy is not None:
+            arrays = [smpte_noise.numpy.array(block) for block in clipped]
+            timed("pack-numpy", lambda: [smpte_noise._numpy_pack(block, channels) for block in arrays],
+                  nbytes, channels)
+
+        def peaks():
+            pyramid = smpte_peaks.PeakPyramid(sampleRate, channels)
+            for chunk in packed:
+                pyramid.feed(chunk)
+            pyramid.close()
+        timed("peaks", peaks, nbytes, channels)
+
+        def write():
+            with tempfile.TemporaryFile() as writer:
+                for chunk in packed:
+                    writer.write(chunk)
+                writer.flush()
+                os.fsync(writer.fileno())
+        timed("write", write, nbytes, channels)
+
+    return results
+
+
+# Render one complete file with the noise cache in `cacheDir`; run in a
+# fresh process.
+def _bench_engine(engine, sampleRate, channels, duration, cacheDir):
+    os.environ["SMPTE_NOISE_CACHE"] = cacheDir
+    reset_peak_rss()
+    config = smpte_noise.get_config(sampleRate)
+    handle, path = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    try:
+        start = time.perf_counter()
+        stats = smpte_noise.write_wav(path, duration=duration, channels=channels, config=config, engine=engine)
+        seconds = time.perf_counter() - start
+        nbytes = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    result = _case("engine", engine, sampleRate, seconds, stats.count, nbytes, channels, duration)
+    result["peak_rss"] = peak_rss()
+    return result
+
+
+# A multiprocessing context whose children do not inherit the memory of
+# this process. The fork server is started at once, while this process is
+# still small.
+def _context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def _isolated(context, func, *args):
+    with context.Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+# Digest of an engine's first two output periods, for the bit-exactness
+# check against the reference loop.
+def _digest(engine, sampleRate):
+    config = smpte_noise.get_config(sampleRate)
+    digest = hashlib.sha1()
+    for chunk in smpte_noise.ENGINES[engine](config, 2, 1, smpte_noise.NoiseStats(sampleRate)):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run(engines, sampleRates, channelCounts, durations, stageSamples, repeat=5):
+    context = _context()
+    # Keep the user's cache out of the measurements, and the benchmark's
+    # files out of the user's cache.
+    root = tempfile.mkdtemp(prefix="smpte_bench-")
+    previousCache = os.environ.get("SMPTE_NOISE_CACHE")
+    os.environ["SMPTE_NOISE_CACHE"] = os.path.join(root, "parent")
+    results = []
+    try:
+        for sampleRate in sampleRates:
+            results.extend(bench_stages(sampleRate, channelCounts, stageSamples, repeat))
+
+            expected = _digest("reference", sampleRate)
+            for engine in engines:
+                exact = engine == "reference" or _digest(engine, sampleRate) == expected
+                for duration in durations:
+                    for channels in channelCounts:
+                        cacheDir = os.path.join(root, "{0}-{1}-{2}-{3}".format(engine, sampleRate, channels, duration))
+                        for cache in ("cold", "warm"):
+                            result = _isolated(context, _bench_engine, engine, sampleRate, channels, duration, cacheDir)
+                            result["cache"] = cache
+                            result["bit_exact"] = exact
+                            results.append(result)
+                            sys.stderr.write("{0:>9} {1} Hz {2:>2} ch {3:>5} s {4}: {5:10.0f} samples/s {6:7.1f} MB/s{7}\n".format(
+                                engine, sampleRate, channels, duration, cache, result["samples_per_sec"],
+                                result["mb_per_sec"], "" if exact else " (not bit-exact)"))
+    finally:
+        if previousCache is None:
+            del os.environ["SMPTE_NOISE_CACHE"]
+        else:
+            os.environ["SMPTE_NOISE_CACHE"] = previousCache
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "version": smpte_noise.VERSION,
+        "python": platform.python_version(),
+        "numpy": smpte_noise.numpy.__version__ if smpte_noise.numpy is not None else None,
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def _key(result):
+    return (result["kind"], result["name"], result["sample_rate"], result["channels"], result["duration"],
+            result.get("cache"))
+
+
+# Compare a run with a baseline run. Returns a list of regressions.
+def compare(report, baseline, tolerance):
+    previous = dict((_key(result), result) for result in baseline["results"])
+    regressions = []
+    for result in report["results"]:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+        if old.get("bit_exact") and not result.get("bit_exact"):
+            regressions.append("{0}: no longer bit-exact".format(_key(result)))
+        if old["samples_per_sec"] and result["samples_per_sec"] < old["samples_per_sec"] * (1.0 - tolerance):
+            regressions.append("{0}: {1:.0f} samples/s, baseline {2:.0f}".format(
+                _key(result), result["samples_per_sec"], old["samples_per_sec"]))
+    return regressions
+
+
+def _list(value, cast):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def _option_parser():
+    parser = OptionParser(usage="""%prog [options]""",
+                          description="Benchmark the ST 2095-1 pink noise generator.")
+
+    parser.set_defaults(Engines = ",".join(sorted(smpte_noise.ENGINES)),
+                        SampleRates = "48000,96000",
+                        Channels = "1,8",
+                        Durations = "10",
+                        StageSamples = 4 * smpte_noise.blockSize,
+                        Repeat = 5,
+                        Output = None,
+                        Baseline = None,
+                        Tolerance = 0.10
+                        )
+
+    parser.add_option('-e', '--engines', action='store', dest='Engines', metavar='<list>',
+                      help="Comma separated engines to benchmark (default: %default)")
+
+    parser.add_option('-r', '--rates', action='store', dest='SampleRates', metavar='<list>',
+                      help="Comma separated sample rates (default: %default)")
+
+    parser.add_option('-c', '--channels', action='store', dest='Channels', metavar='<list>',
+                      help="Comma separated channel counts (default: %default)")
+
+    parser.add_option('-d', '--durations', action='store', dest='Durations', metavar='<list>',
+                      help="Comma separated durations in seconds, e.g. 10,60,3600 (default: %default)")
+
+    parser.add_option('--stage-samples', action='store', dest='StageSamples', type="int", metavar='<n>',
+                      help="Number of samples for the per-stage measurements (default: %default)")
+
+    parser.add_option('--repeat', action='store', dest='Repeat', type="int", metavar='<n>',
+                      help="Time each stage <n> times and keep the best (default: %default)")
+
+    parser.add_option('-o', '--output', action='store', dest='Output', metavar='<file>',
+                      help="Write the results as JSON to <file> (default: stdout)")
+
+    parser.add_option('-b', '--baseline', action='store', dest='Baseline', metavar='<file>',
+                      help="Fail if slower than the results in <file> by more than the tolerance")
+
+    parser.add_option('-t', '--tolerance', action='store', dest='Tolerance', type="float", metavar='<x>',
+                      help="Allowed slowdown relative to the baseline (default: %default)")
+
+    return parser
+
+
+def main(argv=None):
+    parser = _option_parser()
+    options, args = parser.parse_args(argv)
+
+    engines = _list(options.Engines, str)
+    for engine in engines:
+        if engine not in smpte_noise.ENGINES:
+            parser.error("Unknown engine: {0}".format(engine))
+
+    if options.Repeat < 1:
+        parser.error("The repeat count must be at least 1.")
+
+    report = run(engines, _list(options.SampleRates, int), _list(options.Channels, int),
+                 _list(options.Durations, int), options.StageSamples, options.Repeat)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.Output:
+        with open(options.Output, "w") as writer:
+            writer.write(text + "\n")
+    else:
+        print(text)
+
+    if options.Baseline:
+        with open(options.Baseline) as reader:
+            regressions = compare(report, json.load(reader), options.Tolerance)
+        for regression in regressions:
+            sys.stderr.write("Regression: {0}\n".format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
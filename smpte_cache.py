@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# Content-addressed on-disk cache of ST 2095-1 noise files.
+#
+# The content of a file is fully determined by the generator version, the
+# sample rate, the filter cutoff frequencies, the number of output periods,
+# the channel count and the format. Entries are kept under
+# smpte_noise.cache_dir() and evicted least recently used first once the
+# total size exceeds the cap.
+#
+# Every output starts with the same post-warm-up samples, so a request can
+# also be served from a longer entry with the same settings: the data is a
+# prefix of the longer one and only the header has to be rewritten.
+#
+# Processes may share the cache: choosing and opening the source entry,
+# adding an entry and evicting all run under a lock on cache.lock, and an
+# entry that is open while another process evicts it stays readable.
+#
+
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from optparse import OptionParser
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+import smpte_noise
+
+defaultMaxBytes = 4 * 2**30   # Default size cap of the cache in bytes
+copyChunk = 2**20             # Copy size when os.sendfile is not available
+
+
+# Copy `count` bytes starting at `offset` of the open file `src` to the
+# current position of the open file `dst`.
+def _copy_range(src, dst, offset, count):
+    dst.flush()
+    if hasattr(os, "sendfile"):
+        try:
+            while count > 0:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+            return
+        except OSError:
+            pass    # e.g. not supported for this pair of files; copy below
+    src.seek(offset)
+    while count > 0:
+        data = src.read(min(copyChunk, count))
+        if not data:
+            break
+        dst.write(data)
+        count -= len(data)
+
+
+# Hold an exclusive lock on the open file `lock` (blocking) or release it.
+def _lock(lock):
+    if fcntl is not None:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+    else:
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(lock):
+    if fcntl is not None:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+    else:
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class NoiseCache(object):
+
+    def __init__(self, directory=None, max_bytes=defaultMaxBytes):
+        if directory is None:
+            directory = os.path.join(smpte_noise.cache_dir(), "files")
+        self.directory = directory
+        self.maxBytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    # Entries with the same settings except for their length share a name
+    # prefix, so the longer ones can be found for prefix copies.
+    def _family(self, config, channels, fmt):
+        key = "{0}|{1}|{2!r}|{3!r}|{4}|{5}".format(smpte_noise.VERSION, config.SampleRate,
+                                                   config.HpFc, config.LpFc, channels, fmt)
+        return hashlib.sha1(key.encode("ascii")).hexdigest()[:20]
+
+    def _path(self, family, periods):
+        return os.path.join(self.directory, "{0}-{1}.pcm".format(family, periods))
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".pcm"):
+                yield os.path.join(self.directory, name)
+
+    # Hold the file lock `name` in the cache directory.
+    @contextmanager
+    def _locked(self, name):
+        with open(os.path.join(self.directory, name), "a+b") as lock:
+            _lock(lock)
+            try:
+                yield
+            finally:
+                _unlock(lock)
+
+    def _header(self, config, channels, fmt, dataLength):
+        if fmt == "raw":
+            return b""
+        return smpte_noise.wave_header(config, channels, dataLength)
+
+    #
+    # Statistics are kept in a small JSON file so that they cover every
+    # process sharing the cache.
+    #
+    def stats(self):
+        try:
+            with open(os.path.join(self.directory, "stats.json")) as reader:
+                return json.load(reader)
+        except (IOError, OSError, ValueError):
+            return {"hits": 0, "prefix_hits": 0, "misses": 0, "evictions": 0}
+
+    # The read-modify-write of the file runs under a lock on stats.lock,
+    # so that processes sharing the cache do not lose counts.
+    def _count(self, field, n=1):
+        with self._locked("stats.lock"):
+            stats = self.stats()
+            stats[field] = stats.get(field, 0) + n
+            handle, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            with os.fdopen(handle, "w") as writer:
+                json.dump(stats, writer)
+            os.replace(temp, os.path.join(self.directory, "stats.json"))
+
+    # (path, size, mtime) of every entry, skipping entries removed since
+    # the directory was listed (e.g. by `clear` in another process).
+    def _stat_entries(self):
+        entries = []
+        for path in self._entries():
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, info.st_size, info.st_mtime))
+        return entries
+
+    def size(self):
+        return sum(size for path, size, mtime in self._stat_entries())
+
+    # Remove least recently used entries, except `keep`, until the cache
+    # fits its cap.
+    def evict(self, keep=None):
+        with self._locked("cache.lock"):
+            entries = sorted(self._stat_entries(), key=lambda entry: entry[2])
+            total = sum(size for path, size, mtime in entries)
+            for path, size, mtime in entries:
+                if total <= self.maxBytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue    # open in another process on Windows
+                total -= size
+                self._count("evictions")
+
+    def clear(self):
+        with self._locked("cache.lock"):
+            for path in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # Write the requested noise file to `dest` (a file name), serving it
+    # from the cache when possible, then evict entries until the cache fits
+    # its cap. Returns "hit", "prefix" or "miss".
+    def fetch(self, dest, sample_rate=48000, duration=10, channels=1, fmt="wav", hp_fc=10.0, lp_fc=22400.0):
+        config = smpte_noise.get_config(sample_rate, hp_fc, lp_fc)
+        periods = config.output_periods(duration)
+        family = self._family(config, channels, fmt)
+        dataLength = smpte_noise.data_length(config, duration, channels)
+        periodLength = dataLength // periods
+
+        reader, path, length = self._open_source(family, periods)
+        if reader is None:
+            header = self._header(config, channels, fmt, dataLength)
+            if len(header) + dataLength > self.maxBytes:
+                # Too large to keep; render straight to the destination.
+                smpte_noise.write_wav(dest, duration=duration, channels=channels, config=config,
+                                      raw=(fmt == "raw"))
+                self._count("misses")
+                return "miss"
+            handle, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            os.close(handle)
+            try:
+                smpte_noise.write_wav(temp, duration=duration, channels=channels, config=config,
+                                      raw=(fmt == "raw"))
+                path, length = self._path(family, periods), periods
+                with self._locked("cache.lock"):
+                    os.replace(temp, path)
+                    reader = open(path, "rb")
+            except BaseException:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+            self._count("misses")
+            result = "miss"
+        else:
+            self._count("hits" if length == periods else "prefix_hits")
+            result = "hit" if length == periods else "prefix"
+
+        sourceHeader = self._header(config, channels, fmt, periodLength * length)
+        with reader:
+            with open(dest, "wb") as writer:
+                writer.write(self._header(config, channels, fmt, dataLength))
+                _copy_range(reader, writer, len(sourceHeader), dataLength)
+        self.evict(keep=path)
+        return result
+
+    # Open the shortest cached entry of `family` at least `periods` long and
+    # mark it as recently used. Returns (reader, path, periods), or
+    # (None, None, None) when there is none.
+    def _open_source(self, family, periods):
+        with self._locked("cache.lock"):
+            source = None
+            for path in self._entries():
+                name = os.path.basename(path)[:-4]
+                if name.rpartition("-")[0] == family:
+                    length = int(name.rpartition("-")[2])
+                    if length >= periods and (source is None or length < source[1]):
+                        source = (path, length)
+            if source is None:
+                return None, None, None
+            os.utime(source[0], None)
+            return open(source[0], "rb"), source[0], source[1]
+
+
+def _option_parser():
+    parser = OptionParser(usage="""%prog [options] <outfile>\n       %prog --stats | --clear""",
+                          description="Fetch an ST 2095-1 pink noise file through the on-disk cache.")
+
+    parser.set_defaults(Duration_sec = 10,  # Duration of the output stream in seconds
+                        SampleRate = 48000, # Output sample rate in samples/sec
+                        ChannelCount = 1,   # Number of output channels
+                        Format = "wav",     # Output format
+                        MaxSize_mb = defaultMaxBytes // 2**20,
+                        Directory = None
+                        )
+
+    parser.add_option('-9', '--96k', action='store_const', dest='SampleRate', const=96000,
+                      help="Select 96.0 kHz sample rate (default is 48.0 kHz)")
+
+    parser.add_option('-c', '--channels', action='store', dest='ChannelCount', type="int", metavar='<n>',
+                      help="Set the number of channels in the output file")
+
+    parser.add_option('-d', '--duration', action='store', dest='Duration_sec', type="int", metavar='<sec>',
+                      help="Set the minimum duration of the output file in seconds (default: %default)")
+
+    parser.add_option('--raw', action='store_const', dest='Format', const="raw",
+                      help="Write raw PCM without a WAVE header")
+
+    parser.add_option('--cache-dir', action='store', dest='Directory', metavar='<dir>',
+                      help="Cache directory (default: <cache>/files)")
+
+    parser.add_option('--max-size', action='store', dest='MaxSize_mb', type="int", metavar='<MB>',
+                      help="Size cap of the cache in MB (default: %default)")
+
+    parser.add_option('--stats', action='store_true', dest='StatsFlag', default=False,
+                      help="Print cache statistics as JSON and exit")
+
+    parser.add_option('--clear', action='store_true', dest='ClearFlag', default=False,
+                      help="Remove every cached file and exit")
+
+    return parser
+
+
+def main(argv=None):
+    parser = _option_parser()
+    options, args = parser.parse_args(argv)
+
+    cache = NoiseCache(options.Directory, options.MaxSize_mb * 2**20)
+
+    if options.StatsFlag:
+        stats = cache.stats()
+        stats["bytes"] = cache.size()
+        print(json.dumps(stats, sort_keys=True))
+        return
+    if options.ClearFlag:
+        cache.clear()
+        return
+
+    if not args:
+        parser.error("Output filename required.")
+
+    print(cache.fetch(args[0], options.SampleRate, options.Duration_sec, options.ChannelCount, options.Format))
+
+
+if __name__ == "__main__":
+    main()
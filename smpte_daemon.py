@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+# Long-running generation daemon for ST 2095-1 noise files.
+#
+# Each run of smpte_noise.py pays for the interpreter start-up, the filter
+# coefficients and the steady-state pink period before the first sample is
+# written. The daemon computes these once for both sample rates and keeps
+# them in memory, and takes jobs over HTTP on a localhost port:
+#
+#   POST /jobs    JSON job, e.g. {"path": "/abs/out.wav", "sample_rate": 48000,
+#                 "duration": 10, "channels": 2}. The response is a stream of
+#                 NDJSON events: "queued", the Monitor "progress" snapshots,
+#                 then one of "done", "error" or "cancelled".
+#   GET /status   JSON with the number of queued and running jobs.
+#
+# At most `workers` jobs run at a time and at most `queue` more wait; a job
+# submitted to a full queue is refused with status 503. A job whose client
+# disconnects is cancelled and its partial file removed.
+#
+# A job writes wherever its path points, so only local programs may submit
+# one: requests must name this daemon in their Host header (against DNS
+# rebinding), must not carry an Origin header (every browser sends one on
+# cross-origin POSTs) and jobs must be sent as application/json, which a
+# web page cannot do without a CORS preflight that the daemon never
+# answers.
+#
+
+import os
+import sys
+import json
+import queue
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from optparse import OptionParser
+
+import smpte_noise
+
+defaultPort = 8095
+maxChannels = 64
+finalEvents = ("done", "error", "cancelled")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(object):
+
+    def __init__(self, spec):
+        self.path = spec["path"]
+        self.sampleRate = int(spec.get("sample_rate", 48000))
+        self.duration = int(spec.get("duration", 10))
+        self.channels = int(spec.get("channels", 1))
+        self.engine = spec.get("engine")
+        self.raw = bool(spec.get("raw", False))
+        self.jobs = int(spec.get("jobs", 1))
+        self.peaks = bool(spec.get("peaks", False))
+        self.decorrelate = bool(spec.get("decorrelate", False))
+        self.sampleFormat = spec.get("format", "pcm24")
+        if not os.path.isabs(self.path):
+            raise ValueError("path must be absolute")
+        if self.sampleRate not in (48000, 96000):
+            raise ValueError("sample_rate must be 48000 or 96000")
+        if self.duration < 0 or not 1 <= self.channels <= maxChannels or self.jobs < 1:
+            raise ValueError("duration, channels or jobs out of range")
+        if self.engine is not None and self.engine not in smpte_noise.ENGINES:
+            raise ValueError("unknown engine {0}".format(self.engine))
+        if self.engine is not None and self.jobs > 1:
+            raise ValueError("engine cannot be combined with jobs")
+        if self.sampleFormat not in smpte_noise.FORMATS:
+            raise ValueError("unknown format {0}".format(self.sampleFormat))
+        if self.peaks and self.sampleFormat != "pcm24":
+            raise ValueError("peaks need the pcm24 format")
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def run(self):
+        def on_progress(event):
+            if self.cancelled.is_set():
+                raise JobCancelled()
+            if event["event"] == "progress":   # the job's own final event follows
+                self.events.put(event)
+
+        if self.cancelled.is_set():
+            self.events.put({"event": "cancelled"})
+            return
+        taps = []
+        if self.peaks and not self.raw:
+            import smpte_peaks
+            taps.append(smpte_peaks.PeakPyramid(self.sampleRate, self.channels,
+                                                sidecar=smpte_peaks.sidecar_path(self.path)))
+        try:
+            stats = smpte_noise.write_wav(self.path, config=smpte_noise.get_config(self.sampleRate),
+                                          duration=self.duration, channels=self.channels, engine=self.engine,
+                                          raw=self.raw, jobs=self.jobs, taps=taps, decorrelate=self.decorrelate,
+                                          sample_format=self.sampleFormat, monitor=smpte_noise.Monitor(on_progress))
+        except JobCancelled:
+            self._remove_partial()
+            self.events.put({"event": "cancelled"})
+        except Exception as e:
+            self._remove_partial()
+            self.events.put({"event": "error", "message": str(e)})
+        else:
+            self.events.put({"event": "done", "path": self.path, "seconds": stats.seconds(),
+                             "rms_db": stats.rms_db(), "accum": stats.accum, "count": stats.count})
+
+    def _remove_partial(self):
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError:
+            pass
+
+
+class NoiseDaemon(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, workers=1, queue_size=16):
+        ThreadingHTTPServer.__init__(self, address, JobHandler)
+        self.jobs = queue.Queue(queue_size)
+        self.workers = workers
+        self.running = 0
+        self._lock = threading.Lock()
+        for n in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    # Keep the coefficients, the steady-state pink periods and the first
+    # bandpass checkpoint of both sample rates in memory before serving.
+    # Jobs that need more checkpoints extend the index under its lock (see
+    # smpte_noise.bandpass_index), so concurrent workers stay safe.
+    def warm_up(self):
+        for sampleRate in (48000, 96000):
+            config = smpte_noise.get_config(sampleRate)
+            smpte_noise.pink_periods(config)
+            smpte_noise.bandpass_checkpoints(config, 1)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            with self._lock:
+                self.running += 1
+            try:
+                job.run()
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def status(self):
+        return {"version": smpte_noise.VERSION, "workers": self.workers, "running": self.running,
+                "queued": self.jobs.qsize(), "queue_size": self.jobs.maxsize}
+
+
+class JobHandler(BaseHTTPRequestHandler):
+
+    def _reply(self, code, body):
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Refuse requests that come from a web page or through a rebound host
+    # name. Returns True when the request may go on.
+    def _trusted(self):
+        port = self.server.server_address[1]
+        if self.headers.get("Host") not in ("127.0.0.1:{0}".format(port), "localhost:{0}".format(port)):
+            self._reply(403, {"error": "bad host"})
+            return False
+        if self.headers.get("Origin") is not None:
+            self._reply(403, {"error": "cross-origin requests are not allowed"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._trusted():
+            return
+        if self.path != "/status":
+            self._reply(404, {"error": "not found"})
+            return
+        self._reply(200, self.server.status())
+
+    def do_POST(self):
+        if not self._trusted():
+            return
+        if self.path != "/jobs":
+            self._reply(404, {"error": "not found"})
+            return
+        if self.headers.get_content_type() != "application/json":
+            self._reply(415, {"error": "jobs must be sent as application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = Job(json.loads(self.rfile.read(length).decode("utf-8")))
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {"error": str(e) or "bad job"})
+            return
+        try:
+            self.server.jobs.put_nowait(job)
+        except queue.Full:
+            self._reply(503, {"error": "queue full"})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        event = {"event": "queued", "position": self.server.jobs.qsize()}
+        try:
+            while True:
+                self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                if event["event"] in finalEvents:
+                    break
+                event = job.events.get()
+        except (IOError, OSError):
+            job.cancelled.set()    # the client went away
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Submit a job (a dict, see the top of this file) to the daemon at
+# `address` and return its final event. `callback` is called with every
+# event; if it raises, the connection is closed, which cancels the job.
+def submit(spec, address=("127.0.0.1", defaultPort), callback=None, timeout=None):
+    connection = HTTPConnection(address[0], address[1], timeout=timeout)
+    try:
+        connection.request("POST", "/jobs", json.dumps(spec), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise RuntimeError("Daemon refused the job: {0}".format(json.loads(response.read())["error"]))
+        event = None
+        for line in response:
+            event = json.loads(line)
+            if callback is not None:
+                callback(event)
+            if event["event"] in finalEvents:
+                break
+        if event is None or event["event"] not in finalEvents:
+            raise RuntimeError("Daemon closed the connection")
+        return event
+    finally:
+        connection.close()
+
+
+def status(address=("127.0.0.1", defaultPort), timeout=5):
+    connection = HTTPConnection(address[0], address[1], timeout=timeout)
+    try:
+        connection.request("GET", "/status")
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog [options]""",
+                          description="Serve ST 2095-1 noise generation jobs over HTTP on localhost.")
+    parser.add_option('-p', '--port', action='store', dest='Port', type="int", default=defaultPort, metavar='<n>',
+                      help="TCP port on 127.0.0.1 (default: %default)")
+    parser.add_option('-w', '--workers', action='store', dest='Workers', type="int", default=1, metavar='<n>',
+                      help="Number of jobs run at a time (default: %default)")
+    parser.add_option('--queue', action='store', dest='QueueSize', type="int", default=16, metavar='<n>',
+                      help="Number of jobs that may wait for a worker (default: %default)")
+    options, args = parser.parse_args(argv)
+
+    server = NoiseDaemon(("127.0.0.1", options.Port), options.Workers, options.QueueSize)
+    server.warm_up()
+    sys.stderr.write("Listening on http://127.0.0.1:{0}/\n".format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+#
+# Streaming compliance metering of ST 2095-1 noise.
+#
+# A ComplianceMeter is fed PCM chunks while a file is generated (as a tap of
+# smpte_noise.write_wav) or while an existing file is read, and keeps only
+# running figures: overall and windowed RMS, sample and true peak (4x
+# oversampled), crest factor, the number of samples at the clipping
+# threshold, and a Welch-averaged power spectrum (Hann window, 50% overlap)
+# summed into 1/3-octave bands. The result is a JSON-friendly report with a
+# pass/fail verdict against the -21.5 dB FS RMS target and the pink (1/f)
+# slope of the spectrum.
+#
+# The noise repeats with the PRNG period, so by default the spectrum is
+# averaged over the first 11 seconds only; the level figures always cover
+# the whole stream.
+#
+
+import sys
+import json
+import math
+import cmath
+from operator import mul
+from optparse import OptionParser
+
+import smpte_noise
+
+numpy = smpte_noise.numpy
+
+fullScale = 2147483648.0      # Scale of the decoded 32-bit samples
+targetRms = -21.5             # dB FS, ST 2095-1
+pinkSlope = -10.0 * math.log10(2.0)   # dB per octave of a 1/f power spectrum
+oversample = 4                # True peak oversampling factor
+tapsPerPhase = 12             # Interpolation filter length per phase
+
+
+# Windowed-sinc interpolation filter for 4x oversampling, split into its
+# polyphase components (phase 0 reproduces the input samples).
+def _interpolation_phases():
+    length = oversample * tapsPerPhase
+    center = (length - 1) / 2.0
+    taps = []
+    for k in range(length):
+        t = (k - center) / oversample
+        sinc = 1.0 if t == 0 else math.sin(math.pi * t) / (math.pi * t)
+        window = 0.5 - 0.5 * math.cos(2.0 * math.pi * (k + 0.5) / length)
+        taps.append(sinc * window)
+    phases = []
+    for phase in range(oversample):
+        coeffs = taps[phase::oversample]
+        gain = sum(coeffs)
+        phases.append([c / gain for c in reversed(coeffs)])
+    return phases
+
+
+# In-place iterative radix-2 FFT of a list of complex numbers.
+def _fft(values):
+    n = len(values)
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            values[i], values[j] = values[j], values[i]
+    size = 2
+    while size <= n:
+        step = cmath.exp(-2j * math.pi / size)
+        half = size // 2
+        twiddles = [step ** k for k in range(half)]
+        for start in range(0, n, size):
+            for k in range(half):
+                a = values[start + k]
+                b = values[start + k + half] * twiddles[k]
+                values[start + k] = a + b
+                values[start + k + half] = a - b
+        size *= 2
+    return values
+
+
+# Nominal 1/3-octave band centre frequencies (base 10) from 20 Hz to 20 kHz.
+def third_octave_bands(low=20.0, high=20000.0):
+    bands = []
+    for n in range(-20, 14):
+        fc = 1000.0 * 10.0 ** (n / 10.0)
+        if low * 0.99 <= fc <= high * 1.01:
+            bands.append(fc)
+    return bands
+
+
+def _db(value):
+    return 10.0 * math.log10(value) if value > 0 else None
+
+
+class ComplianceMeter(object):
+
+    def __init__(self, sample_rate, channels=1, channel=0, window=1.0, nfft=8192, spectrum_seconds=11.0,
+                 true_peak=True, report=None):
+        self.SampleRate = sample_rate
+        self.channels = channels
+        self.channel = channel
+        self.report = report                   # JSON report written on close()
+        self.clipLevel = int(smpte_noise.get_config(sample_rate).maxAmp * 2147483647.0) >> 8 << 8
+
+        self.count = 0
+        self.accum = 0.0
+        self.samplePeak = 0
+        self.clipCount = 0
+
+        self.windowSize = max(1, int(window * sample_rate))
+        self.windowAccum = 0.0
+        self.windowCount = 0
+        self.windowMin = None
+        self.windowMax = None
+
+        self.truePeak = 0.0 if true_peak else None
+        self._phases = _interpolation_phases()
+        self._history = [0.0] * tapsPerPhase
+
+        self.nfft = nfft
+        self.spectrumSamples = int(spectrum_seconds * sample_rate) if spectrum_seconds else None
+        self._hann = [0.5 - 0.5 * math.cos(2.0 * math.pi * k / nfft) for k in range(nfft)]
+        self._windowPower = sum(w * w for w in self._hann)
+        self._frame = []
+        self._power = [0.0] * (nfft // 2 + 1) if numpy is None else numpy.zeros(nfft // 2 + 1)
+        self._frames = 0
+        self._analyzed = 0
+
+    # Add a chunk of interleaved 24-bit PCM data.
+    def feed(self, data):
+        ints = smpte_noise.unpack_samples(data, self.channels, self.channel)
+        if not ints:
+            return
+        self.count += len(ints)
+
+        peak = max(max(ints), -min(ints))
+        self.samplePeak = max(self.samplePeak, peak)
+        if peak >= self.clipLevel:
+            self.clipCount += sum(1 for x in ints if x >= self.clipLevel or -x >= self.clipLevel)
+
+        samples = [x / fullScale for x in ints]
+        self.accum += math.fsum(map(mul, samples, samples))
+        self._windowed_rms(samples)
+        if self.truePeak is not None:
+            self._true_peak(samples)
+        if self.spectrumSamples is None or self._analyzed < self.spectrumSamples:
+            self._spectrum(samples)
+
+    def _windowed_rms(self, samples):
+        start = 0
+        while start < len(samples):
+            n = min(len(samples) - start, self.windowSize - self.windowCount)
+            part = samples[start : start + n]
+            self.windowAccum += math.fsum(map(mul, part, part))
+            self.windowCount += n
+            start += n
+            if self.windowCount == self.windowSize:
+                level = _db(self.windowAccum / self.windowSize)
+                if level is not None:
+                    self.windowMin = level if self.windowMin is None else min(self.windowMin, level)
+                    self.windowMax = level if self.windowMax is None else max(self.windowMax, level)
+                self.windowAccum = 0.0
+                self.windowCount = 0
+
+    def _true_peak(self, samples):
+        history = self._history + samples
+        if numpy is not None:
+            values = numpy.array(history)
+            peak = self.truePeak
+            for coeffs in self._phases[1:]:
+                out = numpy.convolve(values, coeffs[::-1], mode="valid")
+                peak = max(peak, float(numpy.max(numpy.abs(out))))
+            self.truePeak = peak
+        else:
+            peak = self.truePeak
+            for coeffs in self._phases[1:]:
+                for n in range(len(history) - tapsPerPhase + 1):
+                    value = sum(map(mul, coeffs, history[n : n + tapsPerPhase]))
+                    if value > peak:
+                        peak = value
+                    elif -value > peak:
+                        peak = -value
+            self.truePeak = peak
+        # The input samples themselves are phase 0.
+        self.truePeak = max(self.truePeak, self.samplePeak / fullScale)
+        self._history = history[-tapsPerPhase:]
+
+    def _spectrum(self, samples):
+        frame = self._frame
+        frame.extend(samples)
+        hop = self.nfft // 2
+        while len(frame) >= self.nfft:
+            segment = frame[:self.nfft]
+            if numpy is not None:
+                self._power += numpy.abs(numpy.fft.rfft(numpy.array(segment) * self._hann)) ** 2
+            else:
+                spectrum = _fft([complex(x * w) for x, w in zip(segment, self._hann)])
+                power = self._power
+                for k in range(len(power)):
+                    power[k] += abs(spectrum[k]) ** 2
+            self._frames += 1
+            del frame[:hop]
+            self._analyzed += hop
+        if self.spectrumSamples is not None and self._analyzed >= self.spectrumSamples:
+            del frame[:]
+
+    def close(self):
+        if self.report:
+            with open(self.report, "w") as writer:
+                json.dump(self.result(), writer, indent=2, sort_keys=True)
+                writer.write("\n")
+
+    # Mean square power of each 1/3-octave band, from the Welch average. Each
+    # FFT bin covers +-half a bin around its frequency and is shared between
+    # the bands it overlaps, so narrow low-frequency bands are not empty.
+    def band_levels(self, low=20.0, high=20000.0):
+        if not self._frames:
+            return []
+        binWidth = self.SampleRate / float(self.nfft)
+        scale = 2.0 / (self.nfft * self._windowPower * self._frames)
+        bands = []
+        for fc in third_octave_bands(low, min(high, self.SampleRate / 2.0)):
+            lo = fc * 10.0 ** (-1.0 / 20.0) / binWidth
+            hi = fc * 10.0 ** (1.0 / 20.0) / binWidth
+            power = 0.0
+            for k in range(max(1, int(lo + 0.5)), min(len(self._power), int(hi + 0.5) + 1)):
+                overlap = min(hi, k + 0.5) - max(lo, k - 0.5)
+                if overlap > 0:
+                    power += self._power[k] * overlap
+            bands.append((fc, _db(power * scale)))
+        return bands
+
+    # Return the meter readings and the compliance verdict as a dict.
+    def result(self, rms_tolerance=0.5, slope_range=(40.0, 12500.0), slope_tolerance=0.25, band_tolerance=1.0):
+        rms = _db(self.accum / self.count) if self.count else None
+        samplePeak = 20.0 * math.log10(self.samplePeak / fullScale) if self.samplePeak else None
+        truePeak = None
+        if self.truePeak:
+            truePeak = 20.0 * math.log10(self.truePeak)
+
+        bands = self.band_levels()
+        fit = [(math.log(fc, 2.0), level - 10.0 * math.log10(fc * (10.0 ** 0.05 - 10.0 ** -0.05)))
+               for fc, level in bands if slope_range[0] <= fc <= slope_range[1] and level is not None]
+        slope = None
+        deviation = None
+        if len(fit) >= 2:
+            mx = sum(x for x, y in fit) / len(fit)
+            my = sum(y for x, y in fit) / len(fit)
+            slope = sum((x - mx) * (y - my) for x, y in fit) / sum((x - mx) ** 2 for x, y in fit)
+            deviation = max(abs(y - (my + slope * (x - mx))) for x, y in fit)
+
+        checks = {
+            "rms": rms is not None and abs(rms - targetRms) <= rms_tolerance,
+            "slope": slope is not None and abs(slope - pinkSlope) <= slope_tolerance,
+            "bands": deviation is not None and deviation <= band_tolerance,
+        }
+        return {
+            "sample_rate": self.SampleRate,
+            "samples": self.count,
+            "seconds": self.count / float(self.SampleRate),
+            "rms_dbfs": rms,
+            "window_rms_dbfs": {"min": self.windowMin, "max": self.windowMax,
+                                "window_seconds": self.windowSize / float(self.SampleRate)},
+            "sample_peak_dbfs": samplePeak,
+            "true_peak_dbtp": truePeak,
+            "crest_factor_db": samplePeak - rms if rms is not None and samplePeak is not None else None,
+            "clipped_samples": self.clipCount,
+            "spectrum": {"frames": self._frames, "nfft": self.nfft,
+                         "bands": [{"center_hz": fc, "level_dbfs": level} for fc, level in bands],
+                         "slope_db_per_octave": slope, "max_band_deviation_db": deviation},
+            "limits": {"rms_dbfs": [targetRms - rms_tolerance, targetRms + rms_tolerance],
+                       "slope_db_per_octave": [pinkSlope - slope_tolerance, pinkSlope + slope_tolerance],
+                       "slope_range_hz": list(slope_range), "band_deviation_db": band_tolerance},
+            "checks": checks,
+            "pass": all(checks.values()),
+        }
+
+
+# Meter an existing 24-bit WAVE file.
+def meter_wav(path, **kwargs):
+    with open(path, "rb") as reader:
+        info = smpte_noise.read_wave_info(reader)
+        if info.bitsPerSample != 8 * smpte_noise.sampleSize:
+            raise ValueError("Only 24-bit PCM files are supported.")
+        meter = ComplianceMeter(info.sampleRate, info.channels, **kwargs)
+        chunkSize = smpte_noise.blockSize * smpte_noise.sampleSize * info.channels
+        remaining = info.dataLength
+        while remaining > 0:
+            chunk = reader.read(min(chunkSize, remaining))
+            if not chunk:
+                break
+            meter.feed(chunk)
+            remaining -= len(chunk)
+    meter.close()
+    return meter
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog [options] <wavfile>""",
+                          description="Meter a 24-bit WAVE file for ST 2095-1 compliance and print a JSON report.")
+    parser.add_option('--spectrum-seconds', action='store', dest='SpectrumSeconds', type="float", default=11.0,
+                      metavar='<sec>', help="Average the spectrum over the first <sec> seconds, 0 for all "
+                                            "(default: %default)")
+    parser.add_option('--no-true-peak', action='store_false', dest='TruePeak', default=True,
+                      help="Skip the oversampled true peak measurement")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("Input filename required.")
+
+    meter = meter_wav(args[0], spectrum_seconds=options.SpectrumSeconds or None, true_peak=options.TruePeak)
+    result = meter.result()
+    print(json.dumps(result, indent=2, sort_keys=True))
+    sys.exit(0 if result["pass"] else 1)
+
+
+if __name__ == "__main__":
+    main()
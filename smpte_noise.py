@@ -38,229 +38,1922 @@
 VERSION = "1.4"
 #
 
+import os
 import sys
+import json
 import math
+import time
+import random
 import struct
+import tempfile
+import threading
+from array import array
+from collections import namedtuple
 from optparse import OptionParser
 
-parser = OptionParser(version='%prog v' + VERSION + \
-                      '\nSpecify the -h (help) option for further information about %prog',
-                      usage="""%prog [-h | --help] [--version]\n       %prog [options] <outfile>""",
-                      description="Create a PCM Wave file containing pink noise per SMPTE ST 2095-1:2015.")
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-parser.set_defaults(VerboseFlag = True, # Print statistics to stdout
-                    Duration_sec = 10,  # Duration of the output stream in seconds
-                    SampleRate = 48000, # Output sample rate in samples/sec
-                    HpFc = 10.0,        # Highpass filter cutoff frequency in Hz
-                    LpFc = 22400.0,     # Lowpass filter cutoff frequency in Hz
-                    ChannelCount = 1    # Number of output channels (all identical)
-                    )
 
-parser.add_option('-9', '--96k', action='store_const', dest='SampleRate', const=96000,
-                  help="Select 96.0 kHz sample rate (default is 48.0 kHz)")
+# constants
+sampleSize = 3     # Number of bytes per sample per channel
+maxPeak = -9.5     # Clipping Threshold in dB FS (+/-1.0 = 0 dB)
+blockSize = 65536  # Number of samples produced per block by the engines
 
-parser.add_option('-c', '--channels', action='store', dest='ChannelCount', type="int", metavar='<n>',
-                  help="Set the number of channels in the output file (all contain identical noise)")
 
-parser.add_option('-d', '--duration', action='store', dest='Duration_sec', type="int", metavar='<sec>',
-                  help="Set the minimum duration of the output file in seconds (default: %default)")
+#
+# Precomputed PRNG and filter parameters for one sample rate and band.
+# A NoiseConfig can be reused for any number of renders.
+#
+class NoiseConfig(object):
 
-parser.add_option('-q', '--quiet', action='store_false', dest='VerboseFlag',
-                  help="Suppress output of statistics to stdout")
+    def __init__(self, sample_rate=48000, hp_fc=10.0, lp_fc=22400.0):
+        self.SampleRate = sample_rate
+        self.HpFc = hp_fc
+        self.LpFc = lp_fc
 
-options, args = parser.parse_args()
+        # Initialize variables for generating a random number
 
-if not args:
-    parser.error("Output filename required.")
+        # Perodicity in samples; a power of two, <= 2^31.
+        # Typical values are 524288, 1048576, 2097152 or 4194304.
+        self.samplesPerPeriod = 524288
+        self.randStep = 52737          # Default step size for LCG PRNG
 
-if options.Duration_sec == 0:
-    options.Duration_sec = 10
+        if sample_rate > 48000:
+            self.samplesPerPeriod = 1048576
+            self.randStep = 163841     # Special case LCG step for 1024K samples @ 96k
 
+        # set up PRNG
+        self.randMax = self.samplesPerPeriod - 1
+        self.scaleFactor = 2.0 / float(self.randMax)
 
-# constants
-sampleSize = 3     # Number of bytes per sample per channel
-maxPeak = -9.5     # Clipping Threshold in dB FS (+/-1.0 = 0 dB)
+        # Filter setup, see ST 2095-1:2015 for the details
+        #
+        self.maxAmp = pow(10.0, maxPeak / 20.0)
+
+        # Calculate omegaT for matched Z transform highpass filters
+        w0t = 2.0 * math.pi * hp_fc / float(sample_rate)
 
-# Initialize variables for generating a random number
+        #  Disaster check: Limit LpFc <= Nyquist
+        if self.LpFc > sample_rate/2.0:
+            self.LpFc = sample_rate/2.0
 
-# Perodicity in samples; a power of two, <= 2^31.
-# Typical values are 524288, 1048576, 2097152 or 4194304.
-samplesPerPeriod = 524288
-randStep = 52737		   # Default step size for LCG PRNG
+        # Calculate k for bilinear transform lowpass filters
+        k = math.tan(( 2.0 * math.pi * self.LpFc / float(sample_rate) ) / 2.0)
+        # precalculate k^2 (makes for a little bit cleaner code)
+        k2 = k * k
 
-if options.SampleRate > 48000:
-    samplesPerPeriod = 1048576
-    randStep = 163841      # Special case LCG step for 1024K samples @ 96k
+        # Calculate biquad coefficients for bandpass filter components
+        self.hp1_a1 = -2.0 * math.exp(-0.3826835 * w0t) * math.cos(0.9238795 * w0t)
+        self.hp1_a2 = math.exp(2.0 * -0.3826835 * w0t)
+        self.hp1_b0 = (1.0 - self.hp1_a1 + self.hp1_a2) / 4.0
+        self.hp1_b1 = -2.0 * self.hp1_b0
+        self.hp1_b2 = self.hp1_b0
 
-# set up PRNG
-randMax = samplesPerPeriod - 1
-seed = 0
-white = 0.0
-scaleFactor = 2.0 / float(randMax)
+        self.hp2_a1 = -2.0 * math.exp(-0.9238795 * w0t) * math.cos(0.3826835 * w0t)
+        self.hp2_a2 = math.exp(2.0 * -0.9238795 * w0t)
+        self.hp2_b0 = (1.0 - self.hp2_a1 + self.hp2_a2) / 4.0
+        self.hp2_b1 = -2.0 * self.hp2_b0
+        self.hp2_b2 = self.hp2_b0
 
-# Filter setup, see ST 2095-1:2015 for the details
+        self.lp1_a1 = (2.0 * (k2 - 1.0)) / (k2 + (k / 1.306563) + 1.0)
+        self.lp1_a2 = (k2 - (k / 1.306563) + 1.0) / (k2 + (k / 1.306563) + 1.0)
+        self.lp1_b0 = k2 / (k2 + (k / 1.306563) + 1.0)
+        self.lp1_b1 = 2.0 * self.lp1_b0
+        self.lp1_b2 = self.lp1_b0
+
+        self.lp2_a1 = (2.0 * (k2 - 1.0)) / (k2 + (k / 0.541196) + 1.0)
+        self.lp2_a2 = (k2 - (k / 0.541196) + 1.0) / (k2 + (k / 0.541196) + 1.0)
+        self.lp2_b0 = k2 / (k2 + (k / 0.541196) + 1.0)
+        self.lp2_b1 = 2.0 * self.lp2_b0
+        self.lp2_b2 = self.lp2_b0
+
+    # Number of samples generated for a duration, including the warm-up
+    # period and rounded up to a whole number of PRNG periods.
+    def total_samples(self, duration):
+        if duration == 0:
+            duration = 10
+        totalSamples = self.samplesPerPeriod + ( self.SampleRate * duration )
+        diff = totalSamples % self.samplesPerPeriod
+        if diff != 0:
+            totalSamples += self.samplesPerPeriod - diff
+        return totalSamples
+
+    # Number of PRNG periods written to the output for a duration.
+    def output_periods(self, duration):
+        return self.total_samples(duration) // self.samplesPerPeriod - 1
+
+
+_configs = {}
+
+# Return a shared NoiseConfig, computing the coefficients only once for
+# each combination of sample rate and cutoff frequencies.
+def get_config(sample_rate=48000, hp_fc=10.0, lp_fc=22400.0):
+    key = (sample_rate, hp_fc, lp_fc)
+    if key not in _configs:
+        _configs[key] = NoiseConfig(sample_rate, hp_fc, lp_fc)
+    return _configs[key]
+
+
+#
+# Running statistics of the written samples.
 #
-maxAmp = pow(10.0, maxPeak / 20.0)
-
-# Calculate omegaT for matched Z transform highpass filters
-w0t = 2.0 * math.pi * options.HpFc / float(options.SampleRate)
-
-#  Disaster check: Limit LpFc <= Nyquist
-if options.LpFc > options.SampleRate/2.0:
-    options.LpFc = options.SampleRate/2.0
-
-# Calculate k for bilinear transform lowpass filters
-k = math.tan(( 2.0 * math.pi * options.LpFc / float(options.SampleRate) ) / 2.0)
-# precalculate k^2 (makes for a little bit cleaner code)
-k2 = k * k
-
-# Calculate biquad coefficients for bandpass filter components
-hp1_a1 = -2.0 * math.exp(-0.3826835 * w0t) * math.cos(0.9238795 * w0t)
-hp1_a2 = math.exp(2.0 * -0.3826835 * w0t)
-hp1_b0 = (1.0 - hp1_a1 + hp1_a2) / 4.0
-hp1_b1 = -2.0 * hp1_b0
-hp1_b2 = hp1_b0
-
-hp2_a1 = -2.0 * math.exp(-0.9238795 * w0t) * math.cos(0.3826835 * w0t)
-hp2_a2 = math.exp(2.0 * -0.9238795 * w0t)
-hp2_b0 = (1.0 - hp2_a1 + hp2_a2) / 4.0
-hp2_b1 = -2.0 * hp2_b0
-hp2_b2 = hp2_b0
-
-lp1_a1 = (2.0 * (k2 - 1.0)) / (k2 + (k / 1.306563) + 1.0)
-lp1_a2 = (k2 - (k / 1.306563) + 1.0) / (k2 + (k / 1.306563) + 1.0)
-lp1_b0 = k2 / (k2 + (k / 1.306563) + 1.0)
-lp1_b1 = 2.0 * lp1_b0
-lp1_b2 = lp1_b0
-
-lp2_a1 = (2.0 * (k2 - 1.0)) / (k2 + (k / 0.541196) + 1.0)
-lp2_a2 = (k2 - (k / 0.541196) + 1.0) / (k2 + (k / 0.541196) + 1.0)
-lp2_b0 = k2 / (k2 + (k / 0.541196) + 1.0)
-lp2_b1 = 2.0 * lp2_b0
-lp2_b2 = lp2_b0
-
-# Declare delay line variables for bandpass filter and initialize to zero
-w = 0.0
-hp1w1 = 0.0
-hp1w2 = 0.0
-hp2w1 = 0.0
-hp2w2 = 0.0
-lp1w1 = 0.0
-lp1w2 = 0.0
-lp2w1 = 0.0
-lp2w2 = 0.0
-
-# Declare delay lines for pink filter network and initialize to zero
-pink = 0.0
-lp1 = 0.0
-lp2 = 0.0
-lp3 = 0.0
-lp4 = 0.0
-lp5 = 0.0
-lp6 = 0.0
+class NoiseStats(object):
+
+    def __init__(self, sample_rate, channels=1):
+        self.SampleRate = sample_rate
+        self.channels = channels   # Number of channels counted per frame in `count`
+        self.accum = 0.0
+        self.count = 0
+        self.periodCheck = None    # (mismatches, max LSB error) in period cache mode
+
+    # accumulate squared amplitude for RMS figure.
+    def add(self, block):
+        accum = self.accum
+        for pink in block:
+            accum += (pink * pink)
+        self.accum = accum
+        self.count += len(block)
+
+    def seconds(self):
+        return self.count / float(self.SampleRate * self.channels)
+
+    # RMS level in dB (AES), as printed by the command line tool.
+    def rms_db(self):
+        return 10.0 * math.log10(self.accum / float(self.count)) + 3.01
+
 
 #
-accum = 0.0
-totalSamples = samplesPerPeriod + ( options.SampleRate * options.Duration_sec )
-diff = totalSamples % samplesPerPeriod
-if diff != 0:
-    totalSamples += samplesPerPeriod - diff
-
-# create and write the WAVE header
-dataLength = sampleSize * ( totalSamples - samplesPerPeriod ) * options.ChannelCount
-if dataLength+32 > 2**31-1:
-    raise ValueError("The selected properties exceed the capacity of the header.")
-
-waveHeader = \
-    b"RIFF" + \
-    struct.pack("<i", dataLength + 38) + \
-    b"WAVE" + \
-    b"fmt " + \
-    struct.pack("<ihhiihhh",
-                18,
-                1,
-                options.ChannelCount,
-                options.SampleRate,
-                sampleSize * options.ChannelCount * options.SampleRate,
-                sampleSize * options.ChannelCount,
-                8 * sampleSize,
-                0) + \
-    b"data" + \
-    struct.pack("<i", dataLength)
-
-writer = open(args[0], "wb") #"wb" (b for binary) required for Windows
-writer.write(waveHeader)
-
-# Generate a band-limited pink noise signal and write it to the WAV file.
-# Before writing samples to the output we cycle the generator one complete
-# series to populate the filter bank delay lines.
-
-for i in range(totalSamples):
-    # Generate a pseudorandom integer in the range 0 <= seed <= randMax.
-    # Bitwise AND with randMax zeroes out any unwanted high order bits.
-    seed = (1664525 * seed + randStep) & randMax
-    # Scale to a real number in the range -1.0 <= white <= 1.0
-    white = float(seed) * scaleFactor - 1.0
-
-    # Run pink filter; a parallel network of first-order LP filters, scaled to
-    # produce an output signal with target RMS = -21.5 dB FS (-18.5 dB AES FS)
-    # when bandpass filter cutoff frequencies are 10 Hz and 22.4 kHz.
-    lp1 = 0.9994551 * lp1 + 0.00198166688621989 * white
-    lp2 = 0.9969859 * lp2 + 0.00263702334184061 * white
-    lp3 = 0.9844470 * lp3 + 0.00643213710202331 * white
-    lp4 = 0.9161757 * lp4 + 0.01438952538362820 * white
-    lp5 = 0.6563399 * lp5 + 0.02698408541064610 * white
-    pink = lp1 + lp2 + lp3 + lp4 + lp5 + lp6 + white * 0.0342675832159306
-    lp6 = white * 0.0088766118009356
-
-    # Run bandpass filter; a series network of 4 biquad filters
-    # Biquad filters implemented in Direct Form II
-    w = pink - hp1_a1 * hp1w1 - hp1_a2 * hp1w2
-    pink = hp1_b0 * w + hp1_b1 * hp1w1 + hp1_b2 * hp1w2
-    hp1w2 = hp1w1
-    hp1w1 = w
-
-    w = pink - hp2_a1 * hp2w1 - hp2_a2 * hp2w2
-    pink = hp2_b0 * w + hp2_b1 * hp2w1 + hp2_b2 * hp2w2
-    hp2w2 = hp2w1
-    hp2w1 = w
-
-    w = pink - lp1_a1 * lp1w1 - lp1_a2 * lp1w2
-    pink = lp1_b0 * w + lp1_b1 * lp1w1 + lp1_b2 * lp1w2
-    lp1w2 = lp1w1
-    lp1w1 = w
-
-    w = pink - lp2_a1 * lp2w1 - lp2_a2 * lp2w2
-    pink = lp2_b0 * w + lp2_b1 * lp2w1 + lp2_b2 * lp2w2
-    lp2w2 = lp2w1
-    lp2w1 = w
-
-    # Limit peaks to +/-MaxAmp
-    if pink > maxAmp:
-        pink = maxAmp
-    elif pink < -maxAmp:
-        pink = -maxAmp
-
-    if i > randMax:
-        # accumulate squared amplitude for RMS figure.
-        accum += (pink * pink)
-
-        # Write 3 bytes per sample. Scale to a 32-bit signed integer
-        # and then encode as a little-endian byte sequence.
-        out = struct.pack("<i", int(pink * 2147483647.0))
-
-        # truncate the LSB and write the sample once for each channel
-        for n in range(options.ChannelCount):
-            writer.write(out[1:])
+# Opt-in instrumentation of a render: time and sample counts of each stage,
+# write latency and progress. Reports are passed to `callback` as dicts, at
+# most once per `interval` seconds while rendering and once at the end.
+# Without a Monitor no instrumentation code runs at all.
+#
+class Monitor(object):
+
+    def __init__(self, callback=None, interval=0.5):
+        self.callback = callback
+        self.interval = interval
+        self.stages = []           # stage names in pipeline order
+        self.stageTime = {}        # time spent in a stage and all stages before it
+        self.stageSamples = {}
+        self.stageCalls = {}
+        self.writeTime = 0.0
+        self.writeBytes = 0
+        self.writeCalls = 0
+        self.maxLatency = 0.0      # slowest single write
+        self.total = 0
+        self.done = 0
+        self.started = time.perf_counter()
+        self._lastTime = self.started
+        self._lastDone = 0
+
+    def begin(self, total):
+        self.total = total
+
+    # Time a stage generator. Each stage consumes the one wrapped before it;
+    # `unit` is the size of one sample in the blocks it yields.
+    def stage(self, name, blocks, unit=1):
+        self.stages.append(name)
+        self.stageTime[name] = 0.0
+        self.stageSamples[name] = 0
+        self.stageCalls[name] = 0
+        return self._timed(name, blocks, unit)
+
+    def _timed(self, name, blocks, unit):
+        blocks = iter(blocks)
+        while True:
+            start = time.perf_counter()
+            try:
+                block = next(blocks)
+            except StopIteration:
+                self.stageTime[name] += time.perf_counter() - start
+                return
+            self.stageTime[name] += time.perf_counter() - start
+            self.stageSamples[name] += len(block) // unit
+            self.stageCalls[name] += 1
+            yield block
+
+    def record_write(self, seconds, nbytes):
+        self.writeTime += seconds
+        self.writeBytes += nbytes
+        self.writeCalls += 1
+        self.maxLatency = max(self.maxLatency, seconds)
+
+    def advance(self, samples):
+        self.done += samples
+        if time.perf_counter() - self._lastTime >= self.interval:
+            self.report("progress")
+
+    def finish(self):
+        self.report("done")
+
+    def snapshot(self, event="progress"):
+        now = time.perf_counter()
+        elapsed = now - self.started
+        stages = {}
+        previous = 0.0
+        for name in self.stages:
+            stages[name] = {"seconds": self.stageTime[name] - previous,
+                            "samples": self.stageSamples[name],
+                            "calls": self.stageCalls[name]}
+            previous = self.stageTime[name]
+        recent = now - self._lastTime
+        result = {
+            "event": event,
+            "done": self.done,
+            "total": self.total,
+            "fraction": self.done / float(self.total) if self.total else 0.0,
+            "elapsed": elapsed,
+            "samples_per_sec": self.done / elapsed if elapsed else 0.0,
+            "recent_samples_per_sec": (self.done - self._lastDone) / recent if recent else 0.0,
+            "stages": stages,
+            "write": {"seconds": self.writeTime, "bytes": self.writeBytes, "calls": self.writeCalls,
+                      "max_latency": self.maxLatency},
+        }
+        self._lastTime = now
+        self._lastDone = self.done
+        return result
+
+    def report(self, event):
+        snapshot = self.snapshot(event)
+        if self.callback is not None:
+            self.callback(snapshot)
+
+
+# Monitor callback writing one JSON object per line (NDJSON) to `stream`.
+def ndjson_reporter(stream):
+    def report(event):
+        stream.write(json.dumps(event) + "\n")
+        stream.flush()
+    return report
+
+
+# Generate a band-limited pink noise signal. Before returning samples we
+# cycle the generator one complete series to populate the filter bank
+# delay lines. Yields lists of at most `size` clipped samples covering
+# `periods` PRNG periods after the warm-up.
+def reference_samples(config, periods, size=blockSize):
+    samplesPerPeriod = config.samplesPerPeriod
+    randStep = config.randStep
+    randMax = config.randMax
+    scaleFactor = config.scaleFactor
+    maxAmp = config.maxAmp
+    hp1_a1, hp1_a2, hp1_b0, hp1_b1, hp1_b2 = config.hp1_a1, config.hp1_a2, config.hp1_b0, config.hp1_b1, config.hp1_b2
+    hp2_a1, hp2_a2, hp2_b0, hp2_b1, hp2_b2 = config.hp2_a1, config.hp2_a2, config.hp2_b0, config.hp2_b1, config.hp2_b2
+    lp1_a1, lp1_a2, lp1_b0, lp1_b1, lp1_b2 = config.lp1_a1, config.lp1_a2, config.lp1_b0, config.lp1_b1, config.lp1_b2
+    lp2_a1, lp2_a2, lp2_b0, lp2_b1, lp2_b2 = config.lp2_a1, config.lp2_a2, config.lp2_b0, config.lp2_b1, config.lp2_b2
+
+    seed = 0
+
+    # Declare delay line variables for bandpass filter and initialize to zero
+    hp1w1 = hp1w2 = 0.0
+    hp2w1 = hp2w2 = 0.0
+    lp1w1 = lp1w2 = 0.0
+    lp2w1 = lp2w2 = 0.0
+
+    # Declare delay lines for pink filter network and initialize to zero
+    lp1 = lp2 = lp3 = lp4 = lp5 = lp6 = 0.0
+
+    block = []
+    for i in range(samplesPerPeriod * (periods + 1)):
+        # Generate a pseudorandom integer in the range 0 <= seed <= randMax.
+        # Bitwise AND with randMax zeroes out any unwanted high order bits.
+        seed = (1664525 * seed + randStep) & randMax
+        # Scale to a real number in the range -1.0 <= white <= 1.0
+        white = float(seed) * scaleFactor - 1.0
+
+        # Run pink filter; a parallel network of first-order LP filters, scaled to
+        # produce an output signal with target RMS = -21.5 dB FS (-18.5 dB AES FS)
+        # when bandpass filter cutoff frequencies are 10 Hz and 22.4 kHz.
+        lp1 = 0.9994551 * lp1 + 0.00198166688621989 * white
+        lp2 = 0.9969859 * lp2 + 0.00263702334184061 * white
+        lp3 = 0.9844470 * lp3 + 0.00643213710202331 * white
+        lp4 = 0.9161757 * lp4 + 0.01438952538362820 * white
+        lp5 = 0.6563399 * lp5 + 0.02698408541064610 * white
+        pink = lp1 + lp2 + lp3 + lp4 + lp5 + lp6 + white * 0.0342675832159306
+        lp6 = white * 0.0088766118009356
+
+        # Run bandpass filter; a series network of 4 biquad filters
+        # Biquad filters implemented in Direct Form II
+        w = pink - hp1_a1 * hp1w1 - hp1_a2 * hp1w2
+        pink = hp1_b0 * w + hp1_b1 * hp1w1 + hp1_b2 * hp1w2
+        hp1w2 = hp1w1
+        hp1w1 = w
+
+        w = pink - hp2_a1 * hp2w1 - hp2_a2 * hp2w2
+        pink = hp2_b0 * w + hp2_b1 * hp2w1 + hp2_b2 * hp2w2
+        hp2w2 = hp2w1
+        hp2w1 = w
+
+        w = pink - lp1_a1 * lp1w1 - lp1_a2 * lp1w2
+        pink = lp1_b0 * w + lp1_b1 * lp1w1 + lp1_b2 * lp1w2
+        lp1w2 = lp1w1
+        lp1w1 = w
+
+        w = pink - lp2_a1 * lp2w1 - lp2_a2 * lp2w2
+        pink = lp2_b0 * w + lp2_b1 * lp2w1 + lp2_b2 * lp2w2
+        lp2w2 = lp2w1
+        lp2w1 = w
+
+        # Limit peaks to +/-MaxAmp
+        if pink > maxAmp:
+            pink = maxAmp
+        elif pink < -maxAmp:
+            pink = -maxAmp
+
+        if i > randMax:
+            block.append(pink)
+            if len(block) == size:
+                yield block
+                block = []
     #
+    if block:
+        yield block
+
+
+# Convert clipped samples to 24-bit PCM frames. Each sample is scaled to a
+# 32-bit signed integer, encoded as a little-endian byte sequence, and the
+# LSB is truncated. The whole block is converted at once: the integers are
+# laid out by an array('i'), and the three upper bytes of each are copied
+# into every channel slot of a preallocated frame buffer with strided
+# slice assignments, so the cost per block does not depend on the number
+# of Python operations per channel.
+def pack_samples(block, channels=1):
+    return _pack_ints([int(pink * 2147483647.0) for pink in block], channels)
+
+
+def _pack_ints(values, channels):
+    ints = array("i", values)
+    if sys.byteorder == "big":
+        ints.byteswap()
+    raw = ints.tobytes()
+
+    frameSize = sampleSize * channels
+    data = bytearray(len(ints) * frameSize)
+    for offset in range(0, frameSize, sampleSize):
+        data[offset::frameSize] = raw[1::4]
+        data[offset + 1::frameSize] = raw[2::4]
+        data[offset + 2::frameSize] = raw[3::4]
+    return data
+
+
+# Copy mono PCM data with `size` bytes per sample to every channel of
+# `channels`-channel frames.
+def interleave(data, channels, size=sampleSize):
+    if channels == 1:
+        return data
+    frameSize = size * channels
+    out = bytearray(len(data) * channels)
+    for offset in range(0, frameSize, size):
+        for b in range(size):
+            out[offset + b::frameSize] = data[b::size]
+    return out
+
+
+# Decode one channel of 24-bit PCM frames back to the 32-bit integers
+# they were truncated from (with the LSB zero). The inverse of
+# pack_samples(), also a whole block at a time.
+def unpack_samples(data, channels=1, channel=0):
+    frameSize = sampleSize * channels
+    count = len(data) // frameSize
+    offset = channel * sampleSize
+    raw = bytearray(4 * count)
+    raw[1::4] = data[offset : count * frameSize : frameSize]
+    raw[2::4] = data[offset + 1 : count * frameSize : frameSize]
+    raw[3::4] = data[offset + 2 : count * frameSize : frameSize]
+    ints = array("i")
+    ints.frombytes(bytes(raw))
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return ints
+
+
+#
+# Output sample formats. The 24-bit PCM of the standard is produced by the
+# engines. The other formats are converted from the same clipped samples,
+# a whole block at a time, and written with a WAVE_FORMAT_EXTENSIBLE
+# header (see wave_header()).
+#
+
+SampleFormat = namedtuple("SampleFormat", "formatTag sampleSize description")
+
+FORMATS = {
+    "pcm24": SampleFormat(1, 3, "24-bit PCM, ST 2095-1"),
+    "pcm16": SampleFormat(1, 2, "16-bit PCM with TPDF dither"),
+    "pcm32": SampleFormat(1, 4, "32-bit PCM"),
+    "float32": SampleFormat(3, 4, "32-bit IEEE float"),
+}
+
+ditherSeed = 2095  # Seed of the dither PRNG, so that dithered files are reproducible
+
+
+# 32-bit float samples. The converted array is passed on through the
+# buffer protocol, without another copy.
+def _convert_float32(block):
+    if numpy is not None and isinstance(block, numpy.ndarray):
+        return memoryview(block.astype("<f4")).cast("B")
+    floats = array("f", block)
+    if sys.byteorder == "big":
+        floats.byteswap()
+    return memoryview(floats).cast("B")
+
+
+# 32-bit integer samples: the values pack_samples() truncates to 24 bits.
+def _convert_pcm32(block):
+    if numpy is not None and isinstance(block, numpy.ndarray):
+        return memoryview((block * 2147483647.0).astype("<i4")).cast("B")
+    ints = array("i", [int(pink * 2147483647.0) for pink in block])
+    if sys.byteorder == "big":
+        ints.byteswap()
+    return memoryview(ints).cast("B")
+
+
+# 16-bit samples with triangular (TPDF) dither of +/-1 LSB, rounded to the
+# nearest step. The dither of each sample is the difference of two
+# uniform 16-bit numbers, drawn for the whole block at once with
+# randbytes() from `generator`. NumPy and the standard library use the
+# same numbers and arithmetic, so the output does not depend on the host.
+def _tpdf_converter(generator):
+    scale = 1.0 / 65536
+
+    def convert(block):
+        noise = array("H", generator.randbytes(4 * len(block)))
+        if sys.byteorder == "big":
+            noise.byteswap()
+        if numpy is not None and isinstance(block, numpy.ndarray):
+            noise = numpy.frombuffer(noise, dtype=numpy.uint16).astype(numpy.float64)
+            values = block * 32767.0 + (noise[0::2] - noise[1::2]) * scale
+            return memoryview(numpy.floor(values + 0.5).astype("<i2")).cast("B")
+        floor = math.floor
+        ints = array("h", [floor(pink * 32767.0 + (a - b) * scale + 0.5)
+                           for pink, a, b in zip(block, noise[0::2], noise[1::2])])
+        if sys.byteorder == "big":
+            ints.byteswap()
+        return memoryview(ints).cast("B")
+
+    return convert
+
+
+# A function converting blocks of clipped samples to mono `sample_format`
+# data. Dithered formats keep their PRNG state in the function, so use one
+# converter per render.
+def block_converter(sample_format):
+    if sample_format not in FORMATS:
+        raise ValueError("Unknown sample format: {0}".format(sample_format))
+    if sample_format == "float32":
+        return _convert_float32
+    if sample_format == "pcm32":
+        return _convert_pcm32
+    if sample_format == "pcm16":
+        return _tpdf_converter(random.Random(ditherSeed))
+
+    def convert(block):
+        if numpy is not None and isinstance(block, numpy.ndarray):
+            return _numpy_pack(block, 1)
+        return pack_samples(block)
+
+    return convert
+
+
+# The reference engine: the ST 2095-1 generator loop, one sample at a time.
+def _reference_engine(config, periods, channels, stats, check=False):
+    for block in reference_samples(config, periods):
+        stats.add(block)
+        yield pack_samples(block, channels)
+
+
+# Period cache engine. The output always spans a whole number of PRNG
+# periods, so only the steady-state period following the warm-up is
+# generated and then repeated for the full duration. The filter network is
+# not exactly periodic in floating point (the highpass delay lines carry
+# rounding from one period to the next), so a repeated period may differ
+# from a full render by +/-1 LSB in a few samples per period. With `check`
+# set and more than one period requested, the next period is also generated
+# by the reference loop and compared to the cached one bit for bit.
+def _period_engine(config, periods, channels, stats, check=False):
+    samplesPerPeriod = config.samplesPerPeriod
+    checkPeriod = check and periods > 1
+    blocks = reference_samples(config, 2 if checkPeriod else 1, samplesPerPeriod)
+
+    period = next(blocks)
+    periodStats = NoiseStats(config.SampleRate)
+    periodStats.add(period)
+    periodBuffer = pack_samples(period, channels)
+
+    if checkPeriod:
+        cached = pack_samples(period)
+        actual = pack_samples(next(blocks))
+        mismatches = 0
+        maxError = 0
+        for n in range(0, samplesPerPeriod * sampleSize, sampleSize):
+            if cached[n : n + sampleSize] != actual[n : n + sampleSize]:
+                mismatches += 1
+                maxError = max(maxError, abs(int.from_bytes(cached[n : n + sampleSize], "little", signed=True) -
+                                             int.from_bytes(actual[n : n + sampleSize], "little", signed=True)))
+        stats.periodCheck = (mismatches, maxError)
+
+    for n in range(periods):
+        yield periodBuffer
+    stats.accum += periodStats.accum * periods
+    stats.count += periodStats.count * periods
+
+
+# Return (mult, inc) such that n steps of the LCG take any seed to
+# (mult * seed + inc) & randMax. Runs in O(log n).
+def lcg_jump(config, n):
+    randMax = config.randMax
+    a, c = 1664525, config.randStep
+    mult, inc = 1, 0
+    while n:
+        if n & 1:
+            mult, inc = (a * mult) & randMax, (a * inc + c) & randMax
+        a, c = (a * a) & randMax, ((a + 1) * c) & randMax
+        n >>= 1
+    return mult, inc
+
+
+# Input gains of the pink filter network: lp1 to lp5, the direct path,
+# and the one sample delayed path lp6.
+_pinkInputGains = (0.00198166688621989, 0.00263702334184061, 0.00643213710202331,
+                   0.01438952538362820, 0.02698408541064610, 0.0342675832159306,
+                   0.0088766118009356)
+
+
+# Run the pink filter network over a sequence of white noise values.
+# `state` holds the delay lines [lp1, lp2, lp3, lp4, lp5, lp6] and is updated
+# in place. The products of the coefficients and the input are taken from
+# precomputed sequences; the arithmetic is otherwise that of the reference
+# loop, so the results are identical.
+def _pink_network(products, state):
+    lp1, lp2, lp3, lp4, lp5, lp6 = state
+    out = []
+    append = out.append
+    for b1, b2, b3, b4, b5, b6, b7 in zip(*products):
+        lp1 = 0.9994551 * lp1 + b1
+        lp2 = 0.9969859 * lp2 + b2
+        lp3 = 0.9844470 * lp3 + b3
+        lp4 = 0.9161757 * lp4 + b4
+        lp5 = 0.6563399 * lp5 + b5
+        append(lp1 + lp2 + lp3 + lp4 + lp5 + lp6 + b6)
+        lp6 = b7
+    state[:] = [lp1, lp2, lp3, lp4, lp5, lp6]
+    return out
+
+
+# Run the bandpass filter (4 Direct Form II biquads, as in the reference
+# loop) over a sequence of pink noise values. `state` holds the delay lines
+# [hp1w1, hp1w2, hp2w1, hp2w2, lp1w1, lp1w2, lp2w1, lp2w2] and is updated in
+# place. Returns the unclipped output.
+def _bandpass(config, values, state):
+    hp1_a1, hp1_a2, hp1_b0, hp1_b1, hp1_b2 = config.hp1_a1, config.hp1_a2, config.hp1_b0, config.hp1_b1, config.hp1_b2
+    hp2_a1, hp2_a2, hp2_b0, hp2_b1, hp2_b2 = config.hp2_a1, config.hp2_a2, config.hp2_b0, config.hp2_b1, config.hp2_b2
+    lp1_a1, lp1_a2, lp1_b0, lp1_b1, lp1_b2 = config.lp1_a1, config.lp1_a2, config.lp1_b0, config.lp1_b1, config.lp1_b2
+    lp2_a1, lp2_a2, lp2_b0, lp2_b1, lp2_b2 = config.lp2_a1, config.lp2_a2, config.lp2_b0, config.lp2_b1, config.lp2_b2
+    hp1w1, hp1w2, hp2w1, hp2w2, lp1w1, lp1w2, lp2w1, lp2w2 = state
+    out = []
+    append = out.append
+    for pink in values:
+        w = pink - hp1_a1 * hp1w1 - hp1_a2 * hp1w2
+        pink = hp1_b0 * w + hp1_b1 * hp1w1 + hp1_b2 * hp1w2
+        hp1w2 = hp1w1
+        hp1w1 = w
+
+        w = pink - hp2_a1 * hp2w1 - hp2_a2 * hp2w2
+        pink = hp2_b0 * w + hp2_b1 * hp2w1 + hp2_b2 * hp2w2
+        hp2w2 = hp2w1
+        hp2w1 = w
+
+        w = pink - lp1_a1 * lp1w1 - lp1_a2 * lp1w2
+        pink = lp1_b0 * w + lp1_b1 * lp1w1 + lp1_b2 * lp1w2
+        lp1w2 = lp1w1
+        lp1w1 = w
+
+        w = pink - lp2_a1 * lp2w1 - lp2_a2 * lp2w2
+        append(lp2_b0 * w + lp2_b1 * lp2w1 + lp2_b2 * lp2w2)
+        lp2w2 = lp2w1
+        lp2w1 = w
+    state[:] = [hp1w1, hp1w2, hp2w1, hp2w2, lp1w1, lp1w2, lp2w1, lp2w2]
+    return out
+
+
+# One PRNG period of white noise as a NumPy array. The LCG is an affine
+# recurrence, so the seed sequence is built by repeatedly doubling the
+# filled part of the array with the jump-ahead transform.
+def _numpy_white(config):
+    samplesPerPeriod = config.samplesPerPeriod
+    seeds = numpy.empty(samplesPerPeriod, dtype=numpy.uint64)
+    seeds[0] = config.randStep     # first step from seed = 0
+    filled = 1
+    while filled < samplesPerPeriod:
+        n = min(filled, samplesPerPeriod - filled)
+        mult, inc = lcg_jump(config, filled)
+        seeds[filled : filled + n] = (seeds[:n] * numpy.uint64(mult) + numpy.uint64(inc)) & numpy.uint64(config.randMax)
+        filled += n
+    return seeds.astype(numpy.float64) * config.scaleFactor - 1.0
+
+
+# Quantize clipped samples to 24-bit PCM frames in bulk; the result is
+# identical to pack_samples().
+def _numpy_pack(block, channels):
+    ints = (block * 2147483647.0).astype("<i4")    # truncates toward zero like int()
+    frames = ints.view(numpy.uint8).reshape(-1, 4)[:, 1:]
+    if channels > 1:
+        frames = numpy.repeat(frames, channels, axis=0)
+    return frames.tobytes()
+
+
+_pinkPeriods = {}
+
+# Pink network output of the warm-up period and of the steady-state period
+# that follows it, as array('d'). The network's delay lines return to the
+# same values at the end of every period after the warm-up, so the steady
+# period repeats exactly for the rest of the output. The result depends
+# only on the PRNG period and is computed once per process.
+def pink_periods(config):
+    key = (config.samplesPerPeriod, config.randStep)
+    if key not in _pinkPeriods:
+        if numpy is not None:
+            white = _numpy_white(config)
+            products = [(white * gain).tolist() for gain in _pinkInputGains]
+        else:
+            white = next(prng_stage(config, config.samplesPerPeriod, size=config.samplesPerPeriod))
+            products = [[gain * x for x in white] for gain in _pinkInputGains]
+        del white
+
+        state = [0.0] * 6
+        warmup = array("d", _pink_network(products, state))
+        warmState = list(state)
+        steady = array("d", _pink_network(products, state))
+        if state != warmState:
+            raise RuntimeError("The pink filter network is not periodic after the warm-up.")
+        _pinkPeriods[key] = (warmup, steady)
+    return _pinkPeriods[key]
+
+
+# Clip a block of bandpass output and accumulate its statistics, on a
+# whole array when NumPy is available.
+def _clip_block(config, values, stats):
+    maxAmp = config.maxAmp
+    if numpy is not None:
+        block = numpy.array(values)
+        numpy.clip(block, -maxAmp, maxAmp, out=block)
+        # NumPy sums in a different order; the RMS figure may differ
+        # from the reference in the last digits.
+        stats.accum += float(numpy.dot(block, block))
+        stats.count += len(block)
+        return block
+
+    minAmp = -maxAmp
+    block = [maxAmp if pink > maxAmp else minAmp if pink < minAmp else pink for pink in values]
+    stats.add(block)
+    return block
+
+
+# Clip a block of bandpass output, accumulate its statistics and pack it.
+def _finish_block(config, values, channels, stats):
+    block = _clip_block(config, values, stats)
+    if numpy is not None:
+        return _numpy_pack(block, channels)
+    return pack_samples(block, channels)
+
+
+# NumPy engine. The white noise, the input products of the pink network,
+# clipping and quantization are computed on whole arrays. The recursive
+# filters still run sample by sample in the same order as the reference
+# loop to keep the output bit-exact, but the pink network only runs over
+# the warm-up and the first output period (see pink_periods()). Only the
+# bandpass filter, whose delay lines carry rounding from one period to the
+# next, runs for the full duration. Like the fast engine, it starts from
+# the cached steady period and first bandpass checkpoint when the cache
+# directory holds them.
+def _numpy_engine(config, periods, channels, stats, check=False):
+    steady = steady_period(config)
+    bandState = list(bandpass_checkpoints(config, 1)[0])
+
+    for n in range(periods):
+        for start in range(0, config.samplesPerPeriod, blockSize):
+            values = _bandpass(config, steady[start : start + blockSize], bandState)
+            yield _finish_block(config, values, channels, stats)
+
+
+# The bandpass filter, clipping, RMS statistics and scaling to 32-bit
+# integers fused in one loop over a block of pink noise values. Like
+# _bandpass(), but two samples are handled per iteration so that the two
+# delay lines of each biquad swap roles instead of being copied. `accum`
+# is the running sum of squares, continued in the order of
+# NoiseStats.add(). Returns (ints, accum); `state` is updated in place.
+def _fast_block(config, values, state, accum):
+    hp1_a1, hp1_a2, hp1_b0, hp1_b1, hp1_b2 = config.hp1_a1, config.hp1_a2, config.hp1_b0, config.hp1_b1, config.hp1_b2
+    hp2_a1, hp2_a2, hp2_b0, hp2_b1, hp2_b2 = config.hp2_a1, config.hp2_a2, config.hp2_b0, config.hp2_b1, config.hp2_b2
+    lp1_a1, lp1_a2, lp1_b0, lp1_b1, lp1_b2 = config.lp1_a1, config.lp1_a2, config.lp1_b0, config.lp1_b1, config.lp1_b2
+    lp2_a1, lp2_a2, lp2_b0, lp2_b1, lp2_b2 = config.lp2_a1, config.lp2_a2, config.lp2_b0, config.lp2_b1, config.lp2_b2
+    maxAmp = config.maxAmp
+    minAmp = -maxAmp
+    hp1w1, hp1w2, hp2w1, hp2w2, lp1w1, lp1w2, lp2w1, lp2w2 = state
+    ints = []
+    append = ints.append
+    values = iter(values)
+    for pink, following in zip(values, values):
+        w = pink - hp1_a1 * hp1w1 - hp1_a2 * hp1w2
+        pink = hp1_b0 * w + hp1_b1 * hp1w1 + hp1_b2 * hp1w2
+        hp1w2 = w
+        w = pink - hp2_a1 * hp2w1 - hp2_a2 * hp2w2
+        pink = hp2_b0 * w + hp2_b1 * hp2w1 + hp2_b2 * hp2w2
+        hp2w2 = w
+        w = pink - lp1_a1 * lp1w1 - lp1_a2 * lp1w2
+        pink = lp1_b0 * w + lp1_b1 * lp1w1 + lp1_b2 * lp1w2
+        lp1w2 = w
+        w = pink - lp2_a1 * lp2w1 - lp2_a2 * lp2w2
+        pink = lp2_b0 * w + lp2_b1 * lp2w1 + lp2_b2 * lp2w2
+        lp2w2 = w
+        if pink > maxAmp:
+            pink = maxAmp
+        elif pink < minAmp:
+            pink = minAmp
+        accum += pink * pink
+        append(int(pink * 2147483647.0))
+
+        # The w2 variables now hold the newest values.
+        w = following - hp1_a1 * hp1w2 - hp1_a2 * hp1w1
+        pink = hp1_b0 * w + hp1_b1 * hp1w2 + hp1_b2 * hp1w1
+        hp1w1 = w
+        w = pink - hp2_a1 * hp2w2 - hp2_a2 * hp2w1
+        pink = hp2_b0 * w + hp2_b1 * hp2w2 + hp2_b2 * hp2w1
+        hp2w1 = w
+        w = pink - lp1_a1 * lp1w2 - lp1_a2 * lp1w1
+        pink = lp1_b0 * w + lp1_b1 * lp1w2 + lp1_b2 * lp1w1
+        lp1w1 = w
+        w = pink - lp2_a1 * lp2w2 - lp2_a2 * lp2w1
+        pink = lp2_b0 * w + lp2_b1 * lp2w2 + lp2_b2 * lp2w1
+        lp2w1 = w
+        if pink > maxAmp:
+            pink = maxAmp
+        elif pink < minAmp:
+            pink = minAmp
+        accum += pink * pink
+        append(int(pink * 2147483647.0))
+    state[:] = [hp1w1, hp1w2, hp2w1, hp2w2, lp1w1, lp1w2, lp2w1, lp2w2]
+    return ints, accum
+
+
+# Run the bandpass over a block of the steady period and return its PCM
+# frames, with the fused loop when NumPy is not available.
+def _bandpass_pcm(config, values, state, channels, stats):
+    if numpy is not None or len(values) % 2:
+        return _finish_block(config, _bandpass(config, values, state), channels, stats)
+    ints, stats.accum = _fast_block(config, values, state, stats.accum)
+    stats.count += len(ints)
+    return _pack_ints(ints, channels)
+
+
+_steadyPeriods = {}
+
+# The steady-state pink period of pink_periods(), kept in the cache
+# directory so that later processes load it instead of running the PRNG
+# and the pink network.
+def steady_period(config):
+    key = (config.samplesPerPeriod, config.randStep)
+    if key in _pinkPeriods:
+        return _pinkPeriods[key][1]
+    if key in _steadyPeriods:
+        return _steadyPeriods[key]
+
+    with _cacheLock:
+        if key in _steadyPeriods:
+            return _steadyPeriods[key]
+        name = "pink-{0}-{1}.bin".format(*key)
+        steady = array("d")
+        try:
+            with open(os.path.join(cache_dir(), name), "rb") as reader:
+                steady.frombytes(reader.read())
+            if sys.byteorder == "big":
+                steady.byteswap()
+        except (IOError, OSError, ValueError):
+            steady = array("d")
+        if len(steady) != config.samplesPerPeriod:
+            steady = pink_periods(config)[1]
+            data = array("d", steady)
+            if sys.byteorder == "big":
+                data.byteswap()
+            save_cache_file(name, data.tobytes())
+        _steadyPeriods[key] = steady
+    return steady
+
+
+# Fast engine for the standard library alone. The steady period comes from
+# steady_period() and the bandpass delay lines after the warm-up from the
+# first checkpoint (see bandpass_checkpoints()), so a process with a warm
+# cache directory starts at the first output sample; the rest of the work
+# is the fused loop of _fast_block() and a bulk 24-bit conversion per block.
+def _fast_engine(config, periods, channels, stats, check=False):
+    steady = steady_period(config)
+    state = list(bandpass_checkpoints(config, 1)[0])
+
+    for n in range(periods):
+        for start in range(0, config.samplesPerPeriod, blockSize):
+            yield _bandpass_pcm(config, steady[start : start + blockSize], state, channels, stats)
+
+
+# Clipped samples of `periods` output periods, as the engines compute them
+# before quantization: NumPy arrays when NumPy is available, else lists.
+def sample_blocks(config, periods, stats):
+    steady = steady_period(config)
+    state = list(bandpass_checkpoints(config, 1)[0])
+    for n in range(periods):
+        for start in range(0, config.samplesPerPeriod, blockSize):
+            yield _clip_block(config, _bandpass(config, steady[start : start + blockSize], state), stats)
+
+
+# Frames of `channels` identical channels in `sample_format`.
+def formatted_pcm(config, periods, channels, stats, sample_format):
+    convert = block_converter(sample_format)
+    size = FORMATS[sample_format].sampleSize
+    for block in sample_blocks(config, periods, stats):
+        yield interleave(convert(block), channels, size)
+
+
+#
+# Streaming pipeline: PRNG -> pink filter -> bandpass -> clip -> pack.
+# Each stage is a generator that consumes and yields blocks of at most
+# blockSize samples, so memory use does not depend on the duration. The
+# arithmetic of every stage is that of the reference loop.
+#
+
+# Yield `count` white noise values from the PRNG, starting after `seed`.
+def prng_stage(config, count, seed=0, size=blockSize):
+    randStep = config.randStep
+    randMax = config.randMax
+    scaleFactor = config.scaleFactor
+    for start in range(0, count, size):
+        block = []
+        append = block.append
+        for i in range(min(size, count - start)):
+            seed = (1664525 * seed + randStep) & randMax
+            append(float(seed) * scaleFactor - 1.0)
+        yield block
+
+
+def pink_stage(blocks, state=None):
+    if state is None:
+        state = [0.0] * 6
+    for white in blocks:
+        yield _pink_network([[gain * x for x in white] for gain in _pinkInputGains], state)
+
+
+def bandpass_stage(config, blocks, state=None):
+    if state is None:
+        state = [0.0] * 8
+    for block in blocks:
+        yield _bandpass(config, block, state)
+
+
+# Drop the first `count` samples, i.e. the warm-up period.
+def skip_stage(blocks, count):
+    for block in blocks:
+        if count >= len(block):
+            count -= len(block)
+            continue
+        if count:
+            block = block[count:]
+            count = 0
+        yield block
+
+
+# Limit peaks to +/-MaxAmp
+def clip_stage(config, blocks):
+    maxAmp = config.maxAmp
+    minAmp = -maxAmp
+    for block in blocks:
+        yield [maxAmp if pink > maxAmp else minAmp if pink < minAmp else pink for pink in block]
+
+
+def pack_stage(blocks, channels=1, stats=None):
+    for block in blocks:
+        if stats is not None:
+            stats.add(block)
+        yield pack_samples(block, channels)
+
+
+def _stream_engine(config, periods, channels, stats, check=False, monitor=None):
+    if monitor is None:
+        stage = lambda name, blocks, unit=1: blocks
+    else:
+        stage = monitor.stage
+    blocks = stage("prng", prng_stage(config, config.samplesPerPeriod * (periods + 1)))
+    blocks = stage("pink", pink_stage(blocks))
+    blocks = stage("bandpass", bandpass_stage(config, blocks))
+    blocks = skip_stage(blocks, config.samplesPerPeriod)
+    blocks = stage("clip", clip_stage(config, blocks))
+    return stage("pack", pack_stage(blocks, channels, stats), sampleSize * channels)
+
+
+#
+# Decorrelated channels. Channel k plays the same ST 2095-1 sequence
+# started offsets[k] samples into the PRNG period, i.e. an LCG started
+# from a different seed. The pink network output is exactly periodic, so
+# every channel's input is the cached steady-state period rotated by its
+# offset; only the bandpass filter runs per channel. Like the reference,
+# each channel's bandpass is warmed up over one period before output
+# starts; channel 0 uses the reference warm-up and is identical to the
+# mono output. The delay lines after the warm-up are kept in the cache
+# directory (see decorrelated_states()), so later renders start at the
+# first output sample.
+#
+
+def decorrelated_offsets(config, channels):
+    # The period is a power of two, and an LCG jump by n steps is close to
+    # a jump by n mod 2**k steps plus a constant for large k (half a period
+    # exactly inverts the sign of the white noise), so evenly spaced
+    # offsets give strongly correlated channels. Multiples of the golden
+    # section of the period have no such structure; for up to 64 channels
+    # the correlation between any two stays within 0.03.
+    step = int(config.samplesPerPeriod * 0.6180339887498949) | 1
+    return [k * step % config.samplesPerPeriod for k in range(channels)]
+
+
+# Samples start to stop of the steady period rotated by `offset`.
+def _rotated(steady, offset, start, stop):
+    period = len(steady)
+    first = (start + offset) % period
+    last = first + stop - start
+    if last <= period:
+        return steady[first:last]
+    return steady[first:] + steady[:last - period]
+
+
+# The bandpass cascade over a batch of channels with NumPy. `blocks`
+# yields (samples, channels) arrays and `states` holds the delay lines of
+# each channel as in _bandpass(); it is updated in place. The output
+# arrays together hold the filtered samples in order. The four biquads
+# run as one pipeline over a vector holding every section of every
+# channel: in each step section s filters the output section s-1 produced
+# in the step before, so one step costs the same few vector operations
+# for any number of channels. The arithmetic of each section is that of
+# _bandpass(); only the output is delayed by three steps. Sections that
+# the first sample has not reached yet keep their delay lines, and three
+# more steps at the end take the later sections through the last sample.
+def _bandpass_rows(config, blocks, states):
+    sections = [(config.hp1_a1, config.hp1_a2, config.hp1_b0, config.hp1_b1, config.hp1_b2),
+                (config.hp2_a1, config.hp2_a2, config.hp2_b0, config.hp2_b1, config.hp2_b2),
+                (config.lp1_a1, config.lp1_a2, config.lp1_b0, config.lp1_b1, config.lp1_b2),
+                (config.lp2_a1, config.lp2_a2, config.lp2_b0, config.lp2_b1, config.lp2_b2)]
+    channels = len(states)
+    a1, a2, b0, b1, b2 = [numpy.repeat([section[n] for section in sections], channels) for n in range(5)]
+    inner = 3 * channels
+    multiply, add, subtract = numpy.multiply, numpy.add, numpy.subtract
+    # The delay lines of section s of channel k are at s * channels + k.
+    lines = numpy.array(states, dtype=numpy.float64).reshape(channels, 4, 2)
+    first1 = lines[:, :, 0].T.flatten()
+    first2 = lines[:, :, 1].T.flatten()
+    x, w, y, tmp = [numpy.zeros(4 * channels) for n in range(4)]
+    w1, w2 = first1.copy(), first2.copy()
+    head = x[:channels]
+    tail = x[channels:]
+    last1, last2 = numpy.empty(4 * channels), numpy.empty(4 * channels)
+
+    def steps(rows, out, step):
+        nonlocal w, w1, w2
+        for t in range(len(rows)):
+            head[:] = rows[t]
+            tail[:] = y[:inner]
+            multiply(a1, w1, out=tmp)
+            subtract(x, tmp, out=w)
+            multiply(a2, w2, out=tmp)
+            subtract(w, tmp, out=w)
+            multiply(b0, w, out=y)
+            multiply(b1, w1, out=tmp)
+            add(y, tmp, out=y)
+            multiply(b2, w2, out=tmp)
+            add(y, tmp, out=y)
+            w2, w1, w = w1, w, w2
+            out[t] = y[inner:]
+            if step < 3:
+                # Only sections 0 to `step` have had a sample.
+                w1[(step + 1) * channels:] = first1[(step + 1) * channels:]
+                w2[(step + 1) * channels:] = first2[(step + 1) * channels:]
+            step += 1
+        return step
+
+    step = 0
+    for rows in blocks:
+        out = numpy.empty_like(rows)
+        done = step
+        step = steps(rows, out, step)
+        yield out[max(0, 3 - done):]
+
+    # Section s has filtered the last sample s steps after section 0.
+    out = numpy.empty((3, channels))
+    last1[:channels], last2[:channels] = w1[:channels], w2[:channels]
+    for s in range(1, 4):
+        steps(numpy.zeros((1, channels)), out[s - 1 : s], 3)
+        last1[s * channels : (s + 1) * channels] = w1[s * channels : (s + 1) * channels]
+        last2[s * channels : (s + 1) * channels] = w2[s * channels : (s + 1) * channels]
+    yield out[max(0, 3 - step):]
+
+    lines[:, :, 0] = last1.reshape(4, channels).T
+    lines[:, :, 1] = last2.reshape(4, channels).T
+    for k in range(channels):
+        states[k][:] = lines[k].ravel().tolist()
+
+
+# Rows of the steady period for the channels started at `offsets`, in
+# blocks of blockSize samples over `periods` periods.
+def _steady_rows(config, offsets, periods):
+    samplesPerPeriod = config.samplesPerPeriod
+    steadyArray = numpy.frombuffer(steady_period(config))
+    offsets = numpy.array(offsets)
+    for n in range(periods):
+        for start in range(0, samplesPerPeriod, blockSize):
+            t = numpy.arange(start, min(start + blockSize, samplesPerPeriod))
+            yield steadyArray[(t[:, None] + offsets) % samplesPerPeriod]
+
+
+# Warm up the bandpass of the decorrelated channels first to last - 1 over
+# one period, as the reference does, and return their delay lines. Channel
+# 0 is warmed up by the reference warm-up and starts from the first
+# bandpass checkpoint.
+def _warm_up_channels(config, first, last):
+    offsets = decorrelated_offsets(config, last)
+    states = []
+    if first == 0:
+        states.append(list(bandpass_checkpoints(config, 1)[0]))
+        first = 1
+    if first >= last:
+        return states
+    if numpy is not None and last - first >= batchChannels:
+        batch = [[0.0] * 8 for k in range(first, last)]
+        for out in _bandpass_rows(config, _steady_rows(config, offsets[first:], 1), batch):
+            pass
+        return states + batch
+
+    steady = steady_period(config)
+    for k in range(first, last):
+        state = [0.0] * 8
+        for start in range(0, config.samplesPerPeriod, blockSize):
+            _bandpass(config, _rotated(steady, offsets[k], start, min(start + blockSize, config.samplesPerPeriod)),
+                      state)
+        states.append(state)
+    return states
+
+
+def _decorrelated_numpy(config, periods, channels, stats, sample_format="pcm24"):
+    states = [list(state) for state in decorrelated_states(config, channels)]
+    rows = _steady_rows(config, decorrelated_offsets(config, channels), periods)
+
+    convert = block_converter(sample_format)
+    size = FORMATS[sample_format].sampleSize
+    maxAmp = config.maxAmp
+
+    def finish(block):
+        block = numpy.clip(block, -maxAmp, maxAmp)
+        stats.accum += float(numpy.dot(block.ravel(), block.ravel()))
+        stats.count += block.size
+        if sample_format == "pcm24":
+            ints = (block * 2147483647.0).astype("<i4")
+            return ints.view(numpy.uint8).reshape(len(block), channels, 4)[:, :, 1:].tobytes()
+        # Channel by channel, in the order of _decorrelated_stdlib().
+        data = bytearray(block.size * size)
+        for k in range(channels):
+            mono = convert(numpy.ascontiguousarray(block[:, k]))
+            for b in range(size):
+                data[k * size + b::channels * size] = mono[b::size]
+        return data
+
+    # The pipeline delay shifts the output against the blocks.
+    pending = numpy.empty((0, channels))
+    for out in _bandpass_rows(config, rows, states):
+        pending = numpy.concatenate((pending, out))
+        while len(pending) >= blockSize:
+            yield finish(pending[:blockSize])
+            pending = pending[blockSize:]
+    if len(pending):
+        yield finish(pending)
+
+
+def _decorrelated_stdlib(config, periods, channels, stats, sample_format="pcm24"):
+    steady = steady_period(config)
+    samplesPerPeriod = config.samplesPerPeriod
+    offsets = decorrelated_offsets(config, channels)
+    states = [list(state) for state in decorrelated_states(config, channels)]
+
+    convert = block_converter(sample_format)
+    size = FORMATS[sample_format].sampleSize
+    frameSize = size * channels
+    for n in range(periods):
+        for start in range(0, samplesPerPeriod, blockSize):
+            stop = min(start + blockSize, samplesPerPeriod)
+            data = bytearray((stop - start) * frameSize)
+            for k in range(channels):
+                values = _rotated(steady, offsets[k], start, stop)
+                if sample_format == "pcm24":
+                    mono = _bandpass_pcm(config, values, states[k], 1, stats)
+                else:
+                    mono = convert(_clip_block(config, _bandpass(config, values, states[k]), stats))
+                offset = k * size
+                for b in range(size):
+                    data[offset + b::frameSize] = mono[b::size]
+            yield data
+
+
+# Interleaved PCM of `channels` decorrelated channels over `periods`
+# output periods, starting from the warmed-up delay lines of
+# decorrelated_states(). One step of the NumPy pipeline costs about as much
+# as a dozen samples of the per-channel kernel, so the channels are
+# batched on NumPy only from batchChannels channels up.
+batchChannels = 12
+
+def decorrelated_pcm(config, periods, channels, stats, sample_format="pcm24"):
+    stats.channels = channels    # every channel is counted
+    if numpy is not None and channels >= batchChannels:
+        return _decorrelated_numpy(config, periods, channels, stats, sample_format)
+    return _decorrelated_stdlib(config, periods, channels, stats, sample_format)
+
+
+ENGINES = {
+    "reference": _reference_engine,
+    "period": _period_engine,
+    "stream": _stream_engine,
+    "fast": _fast_engine,
+}
+if numpy is not None:
+    ENGINES["numpy"] = _numpy_engine
+
+
+# Pick the fastest bit-exact engine available on this host. With NumPy,
+# blocks are clipped and packed on arrays, which beats the fused loop of
+# the fast engine.
+def default_engine():
+    if "numpy" in ENGINES:
+        return "numpy"
+    return "fast"
+
+
+# Compare the output of an engine with the reference loop byte for byte
+# over `periods` output periods. Returns the number of differing bytes.
+def parity_check(engine, sample_rate=48000, periods=2, channels=1):
+    config = get_config(sample_rate)
+    stats = NoiseStats(config.SampleRate)
+    expected = b"".join(_reference_engine(config, periods, channels, stats))
+    actual = b"".join(ENGINES[engine](config, periods, channels, stats))
+    if len(expected) != len(actual):
+        return max(len(expected), len(actual))
+    return sum(1 for a, b in zip(expected, actual) if a != b)
+
+
+# Yield the PCM data of the output as chunks of interleaved frames, 24-bit
+# unless another `sample_format` is given. RMS statistics are accumulated
+# in `stats` when one is given. With a Monitor, the stream engine reports
+# each of its stages; the other engines run their stages fused in one loop
+# and are timed as a whole. With `decorrelate`, each channel gets its own
+# noise (see decorrelated_pcm()), and formats other than 24-bit are
+# converted from the clipped samples (see formatted_pcm()); the engine is
+# not used then.
+def iter_pcm(config, duration, channels=1, engine=None, stats=None, check=False, monitor=None, decorrelate=False,
+             sample_format="pcm24"):
+    if engine is None:
+        engine = default_engine()
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine: {0}".format(engine))
+    if sample_format not in FORMATS:
+        raise ValueError("Unknown sample format: {0}".format(sample_format))
+    if stats is None:
+        stats = NoiseStats(config.SampleRate)
+    periods = config.output_periods(duration)
+    frameSize = FORMATS[sample_format].sampleSize * channels
+    if decorrelate and channels > 1:
+        if monitor is None:
+            return decorrelated_pcm(config, periods, channels, stats, sample_format)
+        monitor.begin(periods * config.samplesPerPeriod)
+        return monitor.stage("decorrelated", decorrelated_pcm(config, periods, channels, stats, sample_format),
+                             frameSize)
+    if sample_format != "pcm24":
+        if monitor is None:
+            return formatted_pcm(config, periods, channels, stats, sample_format)
+        monitor.begin(periods * config.samplesPerPeriod)
+        return monitor.stage(sample_format, formatted_pcm(config, periods, channels, stats, sample_format),
+                             frameSize)
+    if monitor is None:
+        return ENGINES[engine](config, periods, channels, stats, check)
+
+    monitor.begin(periods * config.samplesPerPeriod)
+    if engine == "stream":
+        return _stream_engine(config, periods, channels, stats, check, monitor)
+    return monitor.stage(engine, ENGINES[engine](config, periods, channels, stats, check), sampleSize * channels)
+
+
+# Generate the noise and return the PCM data (without a WAVE header).
+def generate(sample_rate=48000, duration=10, channels=1, config=None, engine=None, stats=None, decorrelate=False,
+             sample_format="pcm24"):
+    if config is None:
+        config = get_config(sample_rate)
+    data = bytearray()
+    for chunk in iter_pcm(config, duration, channels, engine, stats, decorrelate=decorrelate,
+                          sample_format=sample_format):
+        data += chunk
+    return data
+
+
+# Length in bytes of the PCM data for a duration and channel count.
+def data_length(config, duration, channels=1, sample_format="pcm24"):
+    return FORMATS[sample_format].sampleSize * ( config.total_samples(duration) - config.samplesPerPeriod ) * channels
+
+
+# Largest data chunk that fits a RIFF WAVE header whose chunks before the
+# data chunk take `chunkLength` bytes.
+def riff_fits(dataLength, chunkLength=26):
+    return dataLength+chunkLength+12 <= 2**31-1
+
+
+# The fmt chunk of a WAVE header, followed by a fact chunk for float data.
+# The 24-bit PCM of the standard keeps its plain PCM fmt chunk; the other
+# formats use WAVE_FORMAT_EXTENSIBLE with no speaker positions assigned.
+def format_chunks(config, channels, dataLength, sample_format="pcm24"):
+    size = FORMATS[sample_format].sampleSize
+    if sample_format == "pcm24":
+        return \
+            b"fmt " + \
+            struct.pack("<ihhiihhh",
+                        18,
+                        1,
+                        channels,
+                        config.SampleRate,
+                        size * channels * config.SampleRate,
+                        size * channels,
+                        8 * size,
+                        0)
+
+    chunks = \
+        b"fmt " + \
+        struct.pack("<IHHIIHHHHIH",
+                    40,
+                    0xFFFE,                                  # WAVE_FORMAT_EXTENSIBLE
+                    channels,
+                    config.SampleRate,
+                    size * channels * config.SampleRate,
+                    size * channels,
+                    8 * size,
+                    22,
+                    8 * size,                                # valid bits
+                    0,                                       # channel mask
+                    FORMATS[sample_format].formatTag) + \
+        b"\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71"   # rest of the KSDATAFORMAT GUID
+    if FORMATS[sample_format].formatTag == 3:
+        chunks += b"fact" + struct.pack("<II", 4, min(dataLength // (size * channels), 0xFFFFFFFF))
+    return chunks
+
+
+# create the WAVE header. Data that does not fit a RIFF header is written
+# as RF64 (EBU Tech 3306), which carries the sizes in a ds64 chunk.
+def wave_header(config, channels, dataLength, sample_format="pcm24"):
+    fmtChunk = format_chunks(config, channels, dataLength, sample_format)
+
+    if riff_fits(dataLength, len(fmtChunk)):
+        return \
+            b"RIFF" + \
+            struct.pack("<i", dataLength + len(fmtChunk) + 12) + \
+            b"WAVE" + \
+            fmtChunk + \
+            b"data" + \
+            struct.pack("<i", dataLength)
+
+    return \
+        b"RF64" + \
+        struct.pack("<I", 0xFFFFFFFF) + \
+        b"WAVE" + \
+        b"ds64" + \
+        struct.pack("<IQQQI",
+                    28,
+                    dataLength + len(fmtChunk) + 48,        # RIFF size
+                    dataLength,                             # data size
+                    dataLength // (FORMATS[sample_format].sampleSize * channels),  # sample frames
+                    0) + \
+        fmtChunk + \
+        b"data" + \
+        struct.pack("<I", 0xFFFFFFFF)
+
+
+WaveInfo = namedtuple("WaveInfo", "formatTag channels sampleRate bitsPerSample dataOffset dataLength")
+
+# Read the header of a RIFF or RF64 WAVE file from the open binary file
+# `reader` and return a WaveInfo, or raise ValueError.
+def read_wave_info(reader):
+    reader.seek(0)
+    riff = reader.read(12)
+    if len(riff) < 12 or riff[:4] not in (b"RIFF", b"RF64") or riff[8:12] != b"WAVE":
+        raise ValueError("Not a WAVE file.")
+
+    fmt = None
+    ds64DataLength = None
+    while True:
+        chunk = reader.read(8)
+        if len(chunk) < 8:
+            raise ValueError("No data chunk found.")
+        chunkId = chunk[:4]
+        chunkSize = struct.unpack("<I", chunk[4:])[0]
+        if chunkId == b"ds64":
+            ds64DataLength = struct.unpack("<QQ", reader.read(16))[1]
+            reader.seek(chunkSize - 16, 1)
+        elif chunkId == b"fmt ":
+            data = reader.read(chunkSize)
+            fmt = struct.unpack_from("<HHIIHH", data)
+            if fmt[0] == 0xFFFE and len(data) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: the format tag starts the SubFormat GUID.
+                fmt = struct.unpack_from("<H", data, 24) + fmt[1:]
+        elif chunkId == b"data":
+            if fmt is None:
+                raise ValueError("No fmt chunk before the data chunk.")
+            if chunkSize == 0xFFFFFFFF and ds64DataLength is not None:
+                chunkSize = ds64DataLength
+            return WaveInfo(fmt[0], fmt[1], fmt[2], fmt[5], reader.tell(), chunkSize)
+        else:
+            reader.seek(chunkSize + (chunkSize & 1), 1)
+
+
+# Open the destination of the output: a file name, "-" for stdout, or an
+# already open binary file object. Returns (writer, close).
+def open_sink(path):
+    if hasattr(path, "write"):
+        return path, False
+    if path == "-":
+        return sys.stdout.buffer, False
+    return open(path, "wb"), True #"wb" (b for binary) required for Windows
+
+
+#
+# Loop export. A file holding exactly one output period, with a sampler
+# loop over all of it, replaces a long render on playout systems. Period n
+# of a long render is the loop period filtered from the bandpass state at
+# its own start, which differs from the state at the start of the loop by
+# floating-point rounding only, so looped playback matches the long render
+# exactly in the first period and within +/-1 LSB in a few samples of each
+# later one (see loop_check()). The pink network and the PRNG are exactly
+# periodic, so there is no seam at the loop point.
+#
+
+# WAVE header of a loop file: the fmt chunk, a cue point at the first
+# sample and a smpl chunk with one forward loop over the whole period.
+def loop_header(config, channels):
+    dataLength = sampleSize * config.samplesPerPeriod * channels
+    fmtChunk = format_chunks(config, channels, dataLength)
+    cueChunk = \
+        b"cue " + \
+        struct.pack("<II", 28, 1) + \
+        struct.pack("<II4sIII",
+                    1,                              # cue point ID
+                    0,                              # play order position
+                    b"data",
+                    0,                              # chunk start
+                    0,                              # block start
+                    0)                              # sample offset
+    smplChunk = \
+        b"smpl" + \
+        struct.pack("<IIIIIIIIII", 60,
+                    0,                              # manufacturer
+                    0,                              # product
+                    1000000000 // config.SampleRate,  # sample period in ns
+                    60,                             # MIDI unity note
+                    0,                              # MIDI pitch fraction
+                    0,                              # SMPTE format
+                    0,                              # SMPTE offset
+                    1,                              # number of loops
+                    0) + \
+        struct.pack("<IIIIII",
+                    1,                              # cue point ID
+                    0,                              # forward loop
+                    0,                              # first sample
+                    config.samplesPerPeriod - 1,    # last sample
+                    0,                              # fraction
+                    0)                              # play count, 0 = forever
+
+    return \
+        b"RIFF" + \
+        struct.pack("<i", dataLength + 4 + len(fmtChunk) + len(cueChunk) + len(smplChunk) + 8) + \
+        b"WAVE" + \
+        fmtChunk + \
+        cueChunk + \
+        smplChunk + \
+        b"data" + \
+        struct.pack("<i", dataLength)
+
+
+# Write a loop file holding the first output period.
+def write_loop(path, sample_rate=48000, channels=1, config=None, engine=None):
+    if config is None:
+        config = get_config(sample_rate)
+    stats = NoiseStats(config.SampleRate)
+    writer, close = open_sink(path)
+    try:
+        writer.write(loop_header(config, channels))
+        for chunk in ENGINES[engine or default_engine()](config, 1, channels, stats):
+            writer.write(chunk)
+        writer.flush()
+    finally:
+        if close:
+            writer.close()
+    return stats
+
+
+# Compare looped playback of the loop period with the first `periods`
+# periods of a long render, each rendered from its bandpass checkpoint.
+# Returns (mismatches, maxError, differingPeriods) in samples and LSB.
+def loop_check(config, periods=2):
+    warmup, steady = pink_periods(config)
+    states = bandpass_checkpoints(config, periods)
+    loop = None
+    mismatches = 0
+    maxError = 0
+    differingPeriods = 0
+    for state in states:
+        period = unpack_samples(_finish_block(config, _bandpass(config, steady, list(state)), 1,
+                                              NoiseStats(config.SampleRate)))
+        if loop is None:
+            loop = period
+            continue
+        if period != loop:
+            differingPeriods += 1
+            for a, b in zip(loop, period):
+                if a != b:
+                    mismatches += 1
+                    maxError = max(maxError, abs(a - b) >> 8)
+    return mismatches, maxError, differingPeriods
+
+
+#
+# Parallel rendering. The output is split at PRNG period boundaries. At
+# each boundary the PRNG seed is 0 and the pink network is in its periodic
+# state, so a segment is fully determined by the bandpass delay lines at
+# its start. Those depend on the floating-point rounding of every earlier
+# sample and are found by running the bandpass filter alone over the
+# preceding periods once; the states are saved in a checkpoint file in the
+# cache directory and reused by every later render at the same settings.
+#
+
+# Directory for files that can be regenerated at any time.
+def cache_dir():
+    return os.environ.get("SMPTE_NOISE_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "smpte_noise"))
+
+
+# Replace the cache file `name` with `data`. Each writer goes through a
+# temporary file of its own, so concurrent writers never mix their data
+# and readers see either the old or the new file. Errors are ignored; the
+# callers keep what they computed in memory.
+def save_cache_file(name, data):
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        handle, temp = tempfile.mkstemp(prefix=name + ".", dir=cache_dir())
+        try:
+            with os.fdopen(handle, "wb") as writer:
+                writer.write(data)
+            os.replace(temp, os.path.join(cache_dir(), name))
+        except (IOError, OSError):
+            os.remove(temp)
+            raise
+    except (IOError, OSError):
+        pass
+
+
+# Held while the cached periods and the bandpass index are built, so that
+# threads of one process build each of them once.
+_cacheLock = threading.RLock()
+
+indexInterval = 8192    # Samples between the bandpass states of the index
+
+_bandpassIndexes = {}
+
+# Bandpass delay lines every indexInterval samples of each of the first
+# `periods` output periods: index[n][k] holds the state before sample
+# k * indexInterval of period n. The index is built in one pass over the
+# periods, saved in the cache directory and extended when more periods
+# are needed. A longer index replaces the shorter one in one step; the
+# published lists are never changed.
+def bandpass_index(config, periods):
+    key = (config.SampleRate, config.HpFc, config.LpFc, indexInterval)
+    index = _bandpassIndexes.get(key, [])
+    if len(index) >= periods:
+        return index[:periods]
+
+    with _cacheLock:
+        index = list(_bandpassIndexes.get(key, []))
+        name = "bandpass-{0}-{1!r}-{2!r}-{3}.bin".format(*key)
+        path = os.path.join(cache_dir(), name)
+        rowSize = 64 * (config.samplesPerPeriod // indexInterval)
+
+        if len(index) < periods and not index and os.path.exists(path):
+            with open(path, "rb") as reader:
+                data = reader.read()
+            if len(data) % rowSize == 0:     # else rebuild it
+                index = [[list(struct.unpack_from("<8d", data, n)) for n in range(row, row + rowSize, 64)]
+                         for row in range(0, len(data), rowSize)]
+
+        if len(index) < periods:
+            steady = steady_period(config)
+            if index:
+                state = list(index[-1][-1])
+                _bandpass(config, steady[-indexInterval:], state)
+            else:
+                state = [0.0] * 8
+                _bandpass(config, pink_periods(config)[0], state)
+            while len(index) < periods:
+                row = []
+                for start in range(0, config.samplesPerPeriod, indexInterval):
+                    row.append(list(state))
+                    _bandpass(config, steady[start : start + indexInterval], state)
+                index.append(row)
+            save_cache_file(name, b"".join(struct.pack("<8d", *state) for row in index for state in row))
+
+        _bandpassIndexes[key] = index
+    return index[:periods]
+
+
+# Bandpass delay lines at the start of each of the first `periods` output
+# periods.
+def bandpass_checkpoints(config, periods):
+    return [row[0] for row in bandpass_index(config, periods)]
+
+
+_decorrelatedStates = {}
+
+# Bandpass delay lines of the first `channels` decorrelated channels after
+# their warm-up, i.e. before their first output sample (see
+# decorrelated_pcm()). Like the bandpass index, they are saved in the cache
+# directory and extended when more channels are needed.
+def decorrelated_states(config, channels):
+    key = (config.SampleRate, config.HpFc, config.LpFc)
+    states = _decorrelatedStates.get(key, [])
+    if len(states) >= channels:
+        return states[:channels]
+
+    with _cacheLock:
+        states = list(_decorrelatedStates.get(key, []))
+        name = "decorrelated-{0}-{1!r}-{2!r}.bin".format(*key)
+        path = os.path.join(cache_dir(), name)
+
+        if len(states) < channels and not states and os.path.exists(path):
+            with open(path, "rb") as reader:
+                data = reader.read()
+            if len(data) % 64 == 0:     # else rebuild it
+                states = [list(struct.unpack_from("<8d", data, n)) for n in range(0, len(data), 64)]
+
+        if len(states) < channels:
+            states = states + _warm_up_channels(config, len(states), channels)
+            save_cache_file(name, b"".join(struct.pack("<8d", *state) for state in states))
+
+        _decorrelatedStates[key] = states
+    return states[:channels]
+
+
+# Render `periods` output periods starting from the bandpass delay lines
+# `state`, and write them at byte `offset` of the file at `path`. Returns
+# the (accum, count) statistics of the segment.
+def _render_segment(path, offset, config, channels, state, periods):
+    steady = steady_period(config)
+    stats = NoiseStats(config.SampleRate)
+    state = list(state)
+    with open(path, "r+b") as writer:
+        writer.seek(offset)
+        for n in range(periods):
+            for start in range(0, config.samplesPerPeriod, blockSize):
+                writer.write(_bandpass_pcm(config, steady[start : start + blockSize], state, channels, stats))
+    return stats.accum, stats.count
+
+
+# Render the PCM data into a preallocated file with `jobs` worker
+# processes, each writing its segments directly into their byte range.
+def _write_parallel(path, config, duration, channels, stats, jobs, raw, monitor=None):
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    periods = config.output_periods(duration)
+    dataLength = data_length(config, duration, channels)
+    header = b"" if raw else wave_header(config, channels, dataLength)
+    with open(path, "wb") as writer:
+        writer.write(header)
+        writer.truncate(len(header) + dataLength)
+
+    states = bandpass_checkpoints(config, periods)
+    periodLength = dataLength // periods
+    step = max(1, periods // (jobs * 4))   # a few segments per worker
+    if monitor is not None:
+        monitor.begin(periods * config.samplesPerPeriod)
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(_render_segment, path, len(header) + n * periodLength, config,
+                                   channels, states[n], min(step, periods - n))
+                   for n in range(0, periods, step)]
+        for future in as_completed(futures):
+            accum, count = future.result()
+            stats.accum += accum
+            stats.count += count
+            if monitor is not None:
+                monitor.advance(count)
+    if monitor is not None:
+        monitor.finish()
+
+
+#
+# Random access. Output sample s is at phase s % samplesPerPeriod of period
+# s // samplesPerPeriod. The pink network input at a phase is the same in
+# every period (see pink_periods()), and the bandpass delay lines at most
+# indexInterval samples before it are in the bandpass index, so a window
+# is rendered from there. Once the index covers a period, the cost of a
+# window depends on its length and not on its position.
+#
+
+# The 24-bit PCM frames of output samples start_sample to
+# start_sample + count - 1, identical to that range of a full render.
+def render(start_sample, count, sample_rate=48000, channels=1, config=None, stats=None):
+    if config is None:
+        config = get_config(sample_rate)
+    if stats is None:
+        stats = NoiseStats(config.SampleRate)
+    if start_sample < 0 or count < 0:
+        raise ValueError("Invalid sample range: {0}, {1}".format(start_sample, count))
+    data = bytearray()
+    if count == 0:
+        return data
+
+    steady = steady_period(config)
+    period, phase = divmod(start_sample, config.samplesPerPeriod)
+    first = phase - phase % indexInterval
+    state = list(bandpass_index(config, period + 1)[period][first // indexInterval])
+    _bandpass(config, steady[first:phase], state)
+    while count:
+        stop = min(config.samplesPerPeriod, phase + count)
+        for start in range(phase, stop, blockSize):
+            data += _bandpass_pcm(config, steady[start : min(start + blockSize, stop)], state, channels, stats)
+        count -= stop - phase
+        phase = 0
+    return data
+
+
+# Bytes offset to offset + length - 1 of the file write_wav() writes, e.g.
+# to answer a range request for a virtual file without generating it.
+def read_range(offset, length, sample_rate=48000, duration=10, channels=1, config=None, raw=False):
+    if config is None:
+        config = get_config(sample_rate)
+    dataLength = data_length(config, duration, channels)
+    header = b"" if raw else wave_header(config, channels, dataLength)
+    end = min(offset + length, len(header) + dataLength)
+    if offset < 0 or offset >= end:
+        return b""
+
+    data = bytearray(header[offset:end])
+    start = max(offset - len(header), 0)
+    stop = end - len(header)
+    if stop > start:
+        frameSize = sampleSize * channels
+        first = start // frameSize
+        pcm = render(first, -(-stop // frameSize) - first, channels=channels, config=config)
+        data += pcm[start - first * frameSize : stop - first * frameSize]
+    return bytes(data)
+
+
+def _feed_taps(chunks, taps):
+    for chunk in chunks:
+        for tap in taps:
+            tap.feed(chunk)
+        yield chunk
+
+
+# Generate the noise and write it to a WAVE file, or raw PCM without a
+# header when `raw` is set. The samples are produced and written one chunk
+# at a time. With `jobs` > 1 and a file name as `path`, the output is
+# rendered by that many worker processes instead; the result is identical.
+# The workers always run the kernel of the default engine, so `engine`
+# cannot be given together with `jobs` > 1. Formats other than 24-bit
+# (`sample_format`, see FORMATS) are always rendered serially. A Monitor given as
+# `monitor` receives stage timings, write latency and progress. Each of
+# `taps` is fed every chunk of PCM data in order through its feed() method
+# and closed with close() at the end.
+# Returns the NoiseStats of the written samples.
+def write_wav(path, sample_rate=48000, duration=10, channels=1, config=None, engine=None, check=False, raw=False,
+              jobs=1, monitor=None, taps=(), decorrelate=False, sample_format="pcm24"):
+    if config is None:
+        config = get_config(sample_rate)
+    if sample_format not in FORMATS:
+        raise ValueError("Unknown sample format: {0}".format(sample_format))
+    if jobs > 1 and engine is not None:
+        raise ValueError("An engine cannot be selected for a render with more than one job")
+    stats = NoiseStats(config.SampleRate)
+
+    if jobs > 1 and not decorrelate and sample_format == "pcm24" and path != "-" and \
+            not hasattr(path, "write"):
+        _write_parallel(path, config, duration, channels, stats, jobs, raw, monitor)
+        if taps:
+            # The segments finish out of order; feed the taps from the file.
+            dataLength = data_length(config, duration, channels)
+            with open(path, "rb") as reader:
+                reader.seek(0 if raw else len(wave_header(config, channels, dataLength)))
+                chunkSize = blockSize * sampleSize * channels
+                for start in range(0, dataLength, chunkSize):
+                    chunk = reader.read(min(chunkSize, dataLength - start))
+                    for tap in taps:
+                        tap.feed(chunk)
+            for tap in taps:
+                tap.close()
+        return stats
+
+    # Build the header first so that bad arguments fail before the
+    # destination is truncated.
+    header = b"" if raw else wave_header(config, channels, data_length(config, duration, channels, sample_format),
+                                         sample_format)
+    writer, close = open_sink(path)
+    try:
+        writer.write(header)
+        chunks = iter_pcm(config, duration, channels, engine, stats, check, monitor, decorrelate, sample_format)
+        if taps:
+            chunks = _feed_taps(chunks, taps)
+        if monitor is None:
+            for chunk in chunks:
+                writer.write(chunk)
+        else:
+            frameSize = FORMATS[sample_format].sampleSize * channels
+            for chunk in chunks:
+                start = time.perf_counter()
+                writer.write(chunk)
+                monitor.record_write(time.perf_counter() - start, len(chunk))
+                monitor.advance(len(chunk) // frameSize)
+        writer.flush()
+    finally:
+        if close:
+            writer.close()
+    for tap in taps:
+        tap.close()
+    if monitor is not None:
+        monitor.finish()
+    return stats
+
+
+def _option_parser():
+    parser = OptionParser(version='%prog v' + VERSION + \
+                          '\nSpecify the -h (help) option for further information about %prog',
+                          usage="""%prog [-h | --help] [--version]\n       %prog [options] <outfile>\n\nUse - as <outfile> to write to stdout.""",
+                          description="Create a PCM Wave file containing pink noise per SMPTE ST 2095-1:2015.")
+
+    parser.set_defaults(VerboseFlag = True, # Print statistics to stdout
+                        Duration_sec = 10,  # Duration of the output stream in seconds
+                        SampleRate = 48000, # Output sample rate in samples/sec
+                        HpFc = 10.0,        # Highpass filter cutoff frequency in Hz
+                        LpFc = 22400.0,     # Lowpass filter cutoff frequency in Hz
+                        ChannelCount = 1,   # Number of output channels
+                        DecorrelateFlag = False, # Independent noise in each channel
+                        Engine = None,      # Generator engine (default: fastest bit-exact engine)
+                        ParityFlag = False, # Check the engine against the reference loop
+                        RawFlag = False,    # Write raw PCM without a WAVE header
+                        Jobs = 1,           # Number of worker processes
+                        Progress = None,    # NDJSON progress destination
+                        PeaksFlag = False,  # Write a peak envelope sidecar file
+                        Meter = None,       # Compliance report destination
+                        LoopFlag = False,   # Write one period with a loop point
+                        Format = "pcm24"    # Output sample format
+                        )
+
+    parser.add_option('-9', '--96k', action='store_const', dest='SampleRate', const=96000,
+                      help="Select 96.0 kHz sample rate (default is 48.0 kHz)")
+
+    parser.add_option('-c', '--channels', action='store', dest='ChannelCount', type="int", metavar='<n>',
+                      help="Set the number of channels in the output file (all contain identical noise "
+                           "unless --decorrelate is given)")
+
+    parser.add_option('--decorrelate', action='store_true', dest='DecorrelateFlag',
+                      help="Give each channel its own noise: the same sequence started at different "
+                           "offsets in the PRNG period (channel 1 is unchanged)")
+
+    parser.add_option('-d', '--duration', action='store', dest='Duration_sec', type="int", metavar='<sec>',
+                      help="Set the minimum duration of the output file in seconds (default: %default)")
+
+    parser.add_option('-q', '--quiet', action='store_false', dest='VerboseFlag',
+                      help="Suppress output of statistics to stdout")
+
+    parser.add_option('-p', '--period-cache', action='store_const', dest='Engine', const="period",
+                      help="Generate one steady-state period and repeat it for the full duration")
+
+    parser.add_option('-e', '--engine', action='store', dest='Engine', type="choice",
+                      choices=sorted(ENGINES), metavar='<name>',
+                      help="Select the generator engine: " + ", ".join(sorted(ENGINES)) + \
+                           " (default: " + default_engine() + ")")
+
+    parser.add_option('-j', '--jobs', action='store', dest='Jobs', type="int", metavar='<n>',
+                      help="Render the output file with <n> worker processes (default: %default). Cannot be "
+                           "combined with -e. The first parallel render of a given length on a cold cache is "
+                           "slower than -j 1: the bandpass checkpoints are computed in a serial pass before the "
+                           "workers start")
+
+    parser.add_option('--loop', action='store_true', dest='LoopFlag',
+                      help="Write exactly one steady-state period with a smpl loop and a cue point, and compare "
+                           "looped playback with the first -d seconds (at least two periods) of a full render")
+
+    parser.add_option('--format', action='store', dest='Format', type="choice",
+                      choices=sorted(FORMATS), metavar='<name>',
+                      help="Select the output sample format: " + \
+                           ", ".join("{0} ({1})".format(name, FORMATS[name].description) for name in sorted(FORMATS)) + \
+                           " (default: %default)")
+
+    parser.add_option('--raw', action='store_true', dest='RawFlag',
+                      help="Write raw little-endian samples without a WAVE header")
+
+    parser.add_option('--progress', action='store', dest='Progress', metavar='<file>',
+                      help="Write stage timings and progress as NDJSON to <file> (- for stderr)")
+
+    parser.add_option('--peaks', action='store_true', dest='PeaksFlag',
+                      help="Also write a min/max/RMS peak envelope to <outfile>.peaks (see smpte_peaks.py)")
+
+    parser.add_option('--meter', action='store', dest='Meter', metavar='<file>',
+                      help="Meter RMS, peaks and the 1/3-octave spectrum while writing and save a JSON "
+                           "compliance report to <file> (see smpte_meter.py)")
+
+    parser.add_option('--parity', action='store_true', dest='ParityFlag',
+                      help="Compare the selected engine with the reference loop at 48 kHz and 96 kHz and exit")
+
+    return parser
+
+
+def main(argv=None):
+    parser = _option_parser()
+    options, args = parser.parse_args(argv)
+
+    if options.ParityFlag:
+        engine = options.Engine or default_engine()
+        failed = False
+        for sampleRate in (48000, 96000):
+            mismatches = parity_check(engine, sampleRate, channels=options.ChannelCount)
+            failed = failed or mismatches != 0
+            print("{0} engine @ {1} Hz: {2}".format(engine, sampleRate,
+                  "identical to the reference" if mismatches == 0 else "{0} bytes differ".format(mismatches)))
+        sys.exit(1 if failed else 0)
+
+    if not args:
+        parser.error("Output filename required.")
+
+    config = get_config(options.SampleRate, options.HpFc, options.LpFc)
+
+    if options.Jobs > 1 and options.Engine is not None:
+        parser.error("-e cannot be combined with -j: the workers always run the default engine's kernel.")
+
+    if options.Format != "pcm24" and (options.LoopFlag or options.PeaksFlag or options.Meter):
+        parser.error("--loop, --peaks and --meter need the 24-bit format.")
+
+    if options.LoopFlag:
+        if options.RawFlag:
+            parser.error("--loop needs a WAVE header.")
+        stats = write_loop(args[0], channels=options.ChannelCount, config=config, engine=options.Engine)
+        if options.VerboseFlag:
+            report = sys.stderr if args[0] == "-" else sys.stdout
+            report.write("{0:0.2f} seconds, RMS (dB) = {1:2.2f}\n".format(stats.seconds(), stats.rms_db()))
+            periods = max(2, config.output_periods(options.Duration_sec))
+            mismatches, maxError, differing = loop_check(config, periods)
+            report.write("Loop check: {0} of {1} repeats differ from a full render in {2} samples (max {3} LSB)\n".format(
+                differing, periods - 1, mismatches, maxError))
+        return
+
+    taps = []
+    if options.PeaksFlag and args[0] != "-":
+        import smpte_peaks
+        taps.append(smpte_peaks.PeakPyramid(options.SampleRate, options.ChannelCount,
+                                            sidecar=smpte_peaks.sidecar_path(args[0])))
+    meter = None
+    if options.Meter:
+        import smpte_meter
+        meter = smpte_meter.ComplianceMeter(options.SampleRate, options.ChannelCount, report=options.Meter)
+        taps.append(meter)
+    monitor = None
+    progress = None
+    if options.Progress == "-":
+        monitor = Monitor(ndjson_reporter(sys.stderr))
+    elif options.Progress:
+        progress = open(options.Progress, "w")
+        monitor = Monitor(ndjson_reporter(progress))
+    try:
+        stats = write_wav(args[0], duration=options.Duration_sec, channels=options.ChannelCount,
+                          config=config, engine=options.Engine, check=options.VerboseFlag, raw=options.RawFlag,
+                          jobs=options.Jobs, monitor=monitor, taps=taps, decorrelate=options.DecorrelateFlag,
+                          sample_format=options.Format)
+    except BrokenPipeError:
+        # The consumer of stdout went away; stop without a traceback.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if progress is not None:
+            progress.close()
+
+    if options.VerboseFlag:
+        # Keep stdout clean for the audio when streaming to it
+        report = sys.stderr if args[0] == "-" else sys.stdout
+        report.write("{0:0.2f} seconds, RMS (dB) = {1:2.2f}\n".format(stats.seconds(), stats.rms_db()))
+
+        if stats.periodCheck is not None:
+            report.write("Period cache check: {0} of {1} samples differ from the reference loop (max {2} LSB)\n".format(
+                stats.periodCheck[0], config.samplesPerPeriod, stats.periodCheck[1]))
+
+    if meter is not None and not meter.result()["pass"]:
+        sys.stderr.write("Compliance check failed, see {0}\n".format(options.Meter))
+        sys.exit(1)
 
-writer.close()
 
-if options.VerboseFlag:
-    accum = 10.0 * math.log10(accum / float(totalSamples - samplesPerPeriod))
-    print("{0:0.2f} seconds, RMS (dB) = {1:2.2f}".format(
-        ( totalSamples - samplesPerPeriod ) / float(options.SampleRate),
-        accum + 3.01))
+if __name__ == "__main__":
+    main()
 
 #
 # end ST-2095-1-noise-generator.py
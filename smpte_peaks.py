@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# Multi-resolution peak envelope of ST 2095-1 noise files.
+#
+# A PeakPyramid keeps the minimum, maximum and sum of squares of one channel
+# for buckets of `base` samples, and for every power-of-two multiple of that
+# bucket size up to the whole file. An envelope of any part of the file at
+# any display width is then read from the coarsest level that still has at
+# least one bucket per column, so drawing costs the same for a 10 second
+# file as for a 10 hour one and zooming never touches the audio again.
+#
+# The pyramid is built while the file is generated (as a tap of
+# smpte_noise.write_wav) or afterwards from an existing file, and can be
+# saved next to the audio as a sidecar file.
+#
+
+import os
+import sys
+import math
+import struct
+from array import array
+from operator import mul
+from optparse import OptionParser
+
+import smpte_noise
+
+fullScale = 2147483648.0      # Scale of the decoded 32-bit samples
+sidecarMagic = b"SMPK"
+sidecarVersion = 1
+
+
+def sidecar_path(path):
+    return path + ".peaks"
+
+
+def _to_le(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class PeakPyramid(object):
+
+    def __init__(self, sample_rate, channels=1, channel=0, base=256, sidecar=None):
+        self.SampleRate = sample_rate
+        self.channels = channels
+        self.channel = channel
+        self.base = base
+        self.sidecar = sidecar
+        self.count = 0
+        # levels[n] = (mins, maxs, sums) for buckets of base * 2**n samples
+        self.levels = [(array("i"), array("i"), array("d"))]
+        self._pending = array("i")
+
+    # Add a chunk of interleaved 24-bit PCM data.
+    def feed(self, data):
+        ints = smpte_noise.unpack_samples(data, self.channels, self.channel)
+        if self._pending:
+            ints = self._pending + ints
+        base = self.base
+        full = len(ints) - len(ints) % base
+        mins, maxs, sums = self.levels[0]
+        for start in range(0, full, base):
+            bucket = ints[start : start + base]
+            mins.append(min(bucket))
+            maxs.append(max(bucket))
+            sums.append(float(sum(map(mul, bucket, bucket))))
+        self.count += full
+        self._pending = ints[full:]
+
+    # Flush the last partial bucket, build the coarser levels and write the
+    # sidecar file if one was requested.
+    def close(self):
+        if self._pending:
+            bucket = self._pending
+            mins, maxs, sums = self.levels[0]
+            mins.append(min(bucket))
+            maxs.append(max(bucket))
+            sums.append(float(sum(map(mul, bucket, bucket))))
+            self.count += len(bucket)
+            self._pending = array("i")
+
+        del self.levels[1:]
+        mins, maxs, sums = self.levels[0]
+        while len(mins) > 1:
+            n = len(mins)
+            mins = array("i", [min(mins[i : i + 2]) for i in range(0, n, 2)])
+            maxs = array("i", [max(maxs[i : i + 2]) for i in range(0, n, 2)])
+            sums = array("d", [sum(sums[i : i + 2]) for i in range(0, n, 2)])
+            self.levels.append((mins, maxs, sums))
+
+        if self.sidecar:
+            self.save(self.sidecar)
+
+    # Return `width` (min, max, rms) tuples, in full scale units, covering
+    # samples start to stop of the channel.
+    def envelope(self, start=0, stop=None, width=480):
+        if stop is None:
+            stop = self.count
+        stop = min(stop, self.count)
+        span = max(1, stop - start)
+
+        level = 0
+        while level + 1 < len(self.levels) and span // (self.base << (level + 1)) >= width:
+            level += 1
+        size = self.base << level
+        mins, maxs, sums = self.levels[level]
+
+        columns = []
+        for x in range(width):
+            first = start + span * x // width
+            last = max(first + 1, start + span * (x + 1) // width)
+            b0 = first // size
+            if b0 >= len(mins):
+                break
+            b1 = min(len(mins), max(b0 + 1, -(-last // size)))
+            samples = min(b1 * size, self.count) - b0 * size
+            columns.append((min(mins[b0:b1]) / fullScale,
+                            max(maxs[b0:b1]) / fullScale,
+                            math.sqrt(sum(sums[b0:b1]) / samples) / fullScale))
+        return columns
+
+    def save(self, path):
+        with open(path, "wb") as writer:
+            writer.write(sidecarMagic + struct.pack("<HIIIQI", sidecarVersion, self.SampleRate, self.channels,
+                                                    self.base, self.count, len(self.levels)))
+            for mins, maxs, sums in self.levels:
+                writer.write(struct.pack("<I", len(mins)))
+                writer.write(_to_le(mins))
+                writer.write(_to_le(maxs))
+                writer.write(_to_le(sums))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as reader:
+            data = reader.read()
+        if data[:4] != sidecarMagic:
+            raise ValueError("Not a peak envelope file.")
+        version, sampleRate, channels, base, count, nlevels = struct.unpack_from("<HIIIQI", data, 4)
+        if version != sidecarVersion:
+            raise ValueError("Unsupported peak envelope version.")
+        pyramid = cls(sampleRate, channels, base=base)
+        pyramid.count = count
+        pyramid.levels = []
+        offset = 4 + struct.calcsize("<HIIIQI")
+        for level in range(nlevels):
+            n = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+            mins = _from_le("i", data[offset : offset + 4 * n])
+            maxs = _from_le("i", data[offset + 4 * n : offset + 8 * n])
+            sums = _from_le("d", data[offset + 8 * n : offset + 16 * n])
+            offset += 16 * n
+            pyramid.levels.append((mins, maxs, sums))
+        return pyramid
+
+    # Build the pyramid of an existing 24-bit WAVE file, reading it once.
+    @classmethod
+    def from_wav(cls, path, channel=0, sidecar=None):
+        with open(path, "rb") as reader:
+            info = smpte_noise.read_wave_info(reader)
+            if info.bitsPerSample != 8 * smpte_noise.sampleSize:
+                raise ValueError("Only 24-bit PCM files are supported.")
+            pyramid = cls(info.sampleRate, info.channels, channel, sidecar=sidecar)
+            frameSize = smpte_noise.sampleSize * info.channels
+            chunkSize = smpte_noise.blockSize * frameSize
+            remaining = info.dataLength
+            while remaining > 0:
+                chunk = reader.read(min(chunkSize, remaining))
+                if not chunk:
+                    break
+                pyramid.feed(chunk)
+                remaining -= len(chunk)
+        pyramid.close()
+        return pyramid
+
+
+# Load the sidecar of a WAVE file if there is one, otherwise build the
+# pyramid from the audio.
+def load_peaks(path):
+    if os.path.exists(sidecar_path(path)):
+        return PeakPyramid.load(sidecar_path(path))
+    return PeakPyramid.from_wav(path)
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog <wavfile> [...]""",
+                          description="Write a min/max/RMS peak envelope sidecar (<wavfile>.peaks) for each file.")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("Input filename required.")
+    for path in args:
+        PeakPyramid.from_wav(path, sidecar=sidecar_path(path))
+
+
+if __name__ == "__main__":
+    main()
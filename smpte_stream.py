@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# Real-time streaming of ST 2095-1 noise for live calibration.
+#
+# The server renders one output period once at start-up (the loop period of
+# smpte_noise.write_loop) and plays it as a ring: every client reads the
+# same immutable buffer at its own position, so clients share the
+# generated noise and take no locks. Only the mono period is kept; each
+# write interleaves its few hundred frames for the client's channel count,
+# so memory does not grow with the clients or their layouts. Output
+# is paced against the monotonic clock at the sample rate, with a short
+# prebuffer sent on connect so that audio starts at once. All clients
+# follow one common sample clock, i.e. they play the same samples at the
+# same time.
+#
+# Looping the period repeats the first period of a long render; later
+# periods of a long render differ from it by +/-1 LSB in a few samples (see
+# smpte_noise.loop_check), which is inaudible and has no seam.
+#
+#   GET /stream?channels=2&format=wav   chunked HTTP, WAVE framed or raw PCM
+#   --tcp <port>                        raw PCM to every TCP connection
+#
+
+import sys
+import time
+import threading
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from optparse import OptionParser
+
+import smpte_noise
+
+defaultPort = 8096
+tick = 0.01          # Seconds between writes to a client
+prebuffer = 0.04     # Seconds of audio sent on connect
+maxChannels = 64     # Most channels a client can ask for
+
+
+class LoopSource(object):
+
+    def __init__(self, config, engine=None):
+        self.config = config
+        stats = smpte_noise.NoiseStats(config.SampleRate)
+        self.mono = b"".join(smpte_noise.ENGINES[engine or smpte_noise.default_engine()](config, 1, 1, stats))
+        self.started = time.monotonic()
+
+    # Position of the common sample clock within the period.
+    def position(self, now=None):
+        now = time.monotonic() if now is None else now
+        return int((now - self.started) * self.config.SampleRate) % self.config.samplesPerPeriod
+
+    # Write the ring to `write` in real time until it raises or `stop` is set.
+    def play(self, write, channels, stop=None):
+        view = memoryview(self.mono)
+        size = smpte_noise.sampleSize
+        periodFrames = self.config.samplesPerPeriod
+        rate = self.config.SampleRate
+
+        start = time.monotonic()
+        position = self.position(start)
+        start -= prebuffer
+        sent = 0
+        while stop is None or not stop.is_set():
+            due = int((time.monotonic() - start) * rate)
+            while sent < due:
+                n = min(due - sent, periodFrames - position)
+                write(smpte_noise.interleave(view[position * size : (position + n) * size], channels))
+                position = (position + n) % periodFrames
+                sent += n
+            time.sleep(tick)
+
+    # A WAVE header for an endless stream: the largest RIFF data size.
+    def wave_header(self, channels):
+        frameSize = smpte_noise.sampleSize * channels
+        dataLength = (2**31 - 1 - 38) // frameSize * frameSize
+        return smpte_noise.wave_header(self.config, channels, dataLength)
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            channels = int(query.get("channels", ["1"])[0])
+            fmt = query.get("format", ["wav"])[0]
+            if url.path != "/stream" or not 1 <= channels <= maxChannels or fmt not in ("wav", "raw"):
+                raise ValueError()
+        except ValueError:
+            self.send_error(400 if url.path == "/stream" else 404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav" if fmt == "wav" else "application/octet-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def write(data):
+            self.wfile.write(b"%x\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+            self.wfile.flush()
+
+        source = self.server.source
+        try:
+            if fmt == "wav":
+                write(source.wave_header(channels))
+            source.play(write, channels)
+        except (IOError, OSError):
+            pass    # the client went away
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StreamServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, source):
+        ThreadingHTTPServer.__init__(self, address, StreamHandler)
+        self.source = source
+
+
+# Raw PCM with the server's default channel count to each TCP connection.
+class RawHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            self.server.source.play(self.request.sendall, self.server.channels)
+        except (IOError, OSError):
+            pass
+
+
+class RawServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, source, channels):
+        socketserver.ThreadingTCPServer.__init__(self, address, RawHandler)
+        self.source = source
+        self.channels = channels
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog [options]""",
+                          description="Stream ST 2095-1 pink noise in real time over HTTP (and raw TCP).")
+    parser.add_option('-9', '--96k', action='store_const', dest='SampleRate', const=96000, default=48000,
+                      help="Select 96.0 kHz sample rate (default is 48.0 kHz)")
+    parser.add_option('-p', '--port', action='store', dest='Port', type="int", default=defaultPort, metavar='<n>',
+                      help="HTTP port (default: %default)")
+    parser.add_option('--tcp', action='store', dest='TcpPort', type="int", default=None, metavar='<n>',
+                      help="Also serve raw PCM on TCP port <n>")
+    parser.add_option('-c', '--channels', action='store', dest='ChannelCount', type="int", default=1, metavar='<n>',
+                      help="Number of channels of the raw TCP stream (default: %default)")
+    parser.add_option('--host', action='store', dest='Host', default="127.0.0.1", metavar='<addr>',
+                      help="Address to listen on (default: %default)")
+    options, args = parser.parse_args(argv)
+
+    if not 1 <= options.ChannelCount <= maxChannels:
+        parser.error("The channel count must be between 1 and {0}.".format(maxChannels))
+
+    start = time.perf_counter()
+    source = LoopSource(smpte_noise.get_config(options.SampleRate))
+    sys.stderr.write("Rendered the loop period in {0:0.2f} s\n".format(time.perf_counter() - start))
+
+    if options.TcpPort:
+        raw = RawServer((options.Host, options.TcpPort), source, options.ChannelCount)
+        thread = threading.Thread(target=raw.serve_forever)
+        thread.daemon = True
+        thread.start()
+        sys.stderr.write("Raw PCM on tcp://{0}:{1}/\n".format(options.Host, options.TcpPort))
+
+    server = StreamServer((options.Host, options.Port), source)
+    sys.stderr.write("Streaming on http://{0}:{1}/stream?channels=1&format=wav\n".format(options.Host, options.Port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
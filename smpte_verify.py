@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Verify that existing WAVE files are byte-exact ST 2095-1 noise.
+#
+# A file is checked without regenerating it. Its header must be exactly the
+# one smpte_noise.wave_header() writes for the sample rate, channel count
+# and data length found in it, the data must be a whole number of PRNG
+# periods with identical channels, and the digest of every period must
+# match an index of expected digests.
+#
+# The index holds one digest per output period of the mono data for each
+# sample rate. It is computed once from the bandpass checkpoints (see
+# smpte_noise.bandpass_checkpoints), in parallel, kept in the cache
+# directory and extended when a longer file is seen. Verification memory
+# maps each file and hashes its periods in worker processes, so it runs
+# at about the speed of the disk.
+#
+
+import os
+import sys
+import mmap
+import hashlib
+import threading
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor
+
+import smpte_noise
+
+digestSize = 16
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=digestSize).digest()
+
+
+# Digests of `periods` mono output periods starting from the bandpass delay
+# lines `state`.
+def _segment_digests(config, state, periods):
+    steady = smpte_noise.steady_period(config)
+    stats = smpte_noise.NoiseStats(config.SampleRate)
+    state = list(state)
+    digests = []
+    for n in range(periods):
+        digest = hashlib.blake2b(digest_size=digestSize)
+        for start in range(0, config.samplesPerPeriod, smpte_noise.blockSize):
+            digest.update(smpte_noise._bandpass_pcm(config, steady[start : start + smpte_noise.blockSize],
+                                                    state, 1, stats))
+        digests.append(digest.digest())
+    return digests
+
+
+_indexes = {}
+_indexLock = threading.Lock()
+
+# Expected digests of the first `periods` output periods. A longer index
+# replaces the shorter one in one step.
+def digest_index(config, periods, jobs=None):
+    key = (config.SampleRate, config.HpFc, config.LpFc)
+    digests = _indexes.get(key, [])
+    if len(digests) >= periods:
+        return digests[:periods]
+
+    with _indexLock:
+        digests = list(_indexes.get(key, []))
+        name = "digests-{0}-{1!r}-{2!r}.bin".format(*key)
+        path = os.path.join(smpte_noise.cache_dir(), name)
+
+        if len(digests) < periods and not digests and os.path.exists(path):
+            with open(path, "rb") as reader:
+                data = reader.read()
+            if len(data) % digestSize == 0:     # else rebuild it
+                digests = [data[n : n + digestSize] for n in range(0, len(data), digestSize)]
+
+        if len(digests) < periods:
+            states = smpte_noise.bandpass_checkpoints(config, periods)
+            first = len(digests)
+            jobs = jobs or os.cpu_count() or 1
+            step = max(1, (periods - first) // (jobs * 4))
+            with ProcessPoolExecutor(jobs) as executor:
+                futures = [executor.submit(_segment_digests, config, states[n], min(step, periods - n))
+                           for n in range(first, periods, step)]
+                for future in futures:
+                    digests.extend(future.result())
+            smpte_noise.save_cache_file(name, b"".join(digests))
+
+        _indexes[key] = digests
+    return digests[:periods]
+
+
+# Check the header of `path`. Returns (config, channels, dataOffset,
+# periods) or raises ValueError with the reason.
+def check_header(path):
+    with open(path, "rb") as reader:
+        info = smpte_noise.read_wave_info(reader)
+        if info.formatTag != 1 or info.bitsPerSample != 8 * smpte_noise.sampleSize:
+            raise ValueError("not 24-bit PCM")
+        if info.sampleRate not in (48000, 96000):
+            raise ValueError("unsupported sample rate {0}".format(info.sampleRate))
+        config = smpte_noise.get_config(info.sampleRate)
+        periodLength = config.samplesPerPeriod * smpte_noise.sampleSize * info.channels
+        if info.channels < 1 or info.dataLength == 0 or info.dataLength % periodLength:
+            raise ValueError("data is not a whole number of PRNG periods")
+        reader.seek(0)
+        header = reader.read(info.dataOffset)
+    if header != smpte_noise.wave_header(config, info.channels, info.dataLength):
+        raise ValueError("header differs from the generator's")
+    if os.path.getsize(path) != info.dataOffset + info.dataLength:
+        raise ValueError("file size does not match the data chunk")
+    return config, info.channels, info.dataOffset, info.dataLength // periodLength
+
+
+# Compare the periods of a file from period `first` on with the expected
+# digests. Returns the indexes of the periods that differ.
+def _check_periods(path, dataOffset, channels, periodLength, first, expected):
+    bad = []
+    frameSize = smpte_noise.sampleSize * channels
+    with open(path, "rb") as reader:
+        data = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(data)
+            for n, digest in enumerate(expected, first):
+                start = dataOffset + n * periodLength
+                period = view[start : start + periodLength]
+                if channels == 1:
+                    ok = _digest(period) == digest
+                else:
+                    # Every channel must be a copy of the first one.
+                    mono = bytearray(periodLength // channels)
+                    for b in range(smpte_noise.sampleSize):
+                        mono[b::smpte_noise.sampleSize] = period[b::frameSize]
+                    ok = _digest(mono) == digest and all(
+                        period[c * smpte_noise.sampleSize + b::frameSize] == mono[b::smpte_noise.sampleSize]
+                        for c in range(1, channels) for b in range(smpte_noise.sampleSize))
+                if not ok:
+                    bad.append(n)
+                del period
+            view.release()
+        finally:
+            data.close()
+    return bad
+
+
+# Verify the files in `paths` with `jobs` worker processes. Returns a dict
+# mapping each path to None when it is byte-exact, or the reason it is not.
+def verify(paths, jobs=None, chunk=8):
+    jobs = jobs or os.cpu_count() or 1
+    results = {}
+    headers = {}
+    for path in paths:
+        try:
+            headers[path] = check_header(path)
+        except (IOError, OSError, ValueError) as error:
+            results[path] = str(error)
+
+    # One index per sample rate, long enough for the longest file.
+    longest = {}
+    for config, channels, dataOffset, periods in headers.values():
+        longest[config] = max(longest.get(config, 0), periods)
+    indexes = dict((config, digest_index(config, periods, jobs)) for config, periods in longest.items())
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = []
+        for path, (config, channels, dataOffset, periods) in headers.items():
+            periodLength = config.samplesPerPeriod * smpte_noise.sampleSize * channels
+            for first in range(0, periods, chunk):
+                futures.append((path, executor.submit(_check_periods, path, dataOffset, channels, periodLength,
+                                                      first, indexes[config][first : min(first + chunk, periods)])))
+        bad = dict((path, []) for path in headers)
+        for path, future in futures:
+            bad[path].extend(future.result())
+
+    for path in headers:
+        if bad[path]:
+            results[path] = "{0} of {1} periods differ (first: period {2})".format(
+                len(bad[path]), headers[path][3], bad[path][0])
+        else:
+            results[path] = None
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage="""%prog [options] <wavfile> [...]""",
+                          description="Check that WAVE files are byte-exact ST 2095-1 pink noise.")
+    parser.add_option('-j', '--jobs', action='store', dest='Jobs', type="int", default=None, metavar='<n>',
+                      help="Number of worker processes (default: number of CPUs)")
+    parser.add_option('-q', '--quiet', action='store_true', dest='QuietFlag', default=False,
+                      help="Only report files that fail")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("Input filename required.")
+
+    results = verify(args, options.Jobs)
+    for path in args:
+        if results[path] is not None:
+            print("FAIL {0}: {1}".format(path, results[path]))
+        elif not options.QuietFlag:
+            print("OK   {0}".format(path))
+    sys.exit(1 if any(reason is not None for reason in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
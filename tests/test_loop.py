@@ -0,0 +1,52 @@
+#
+# A loop file holds the first output period of a full render, with a cue
+# point and a smpl loop over the whole period.
+#
+
+import struct
+
+import pytest
+
+import smpte_noise
+
+
+def read_chunks(data):
+    chunks = {}
+    offset = 12
+    while offset < len(data):
+        chunkId, size = struct.unpack_from("<4sI", data, offset)
+        chunks[chunkId] = data[offset + 8 : offset + 8 + size]
+        offset += 8 + size + (size & 1)
+    return chunks
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+def test_loop_file(tmp_path, channels):
+    config = smpte_noise.get_config(48000)
+    loopPath = tmp_path / "loop.wav"
+    fullPath = tmp_path / "full.wav"
+    smpte_noise.write_loop(str(loopPath), channels=channels, config=config)
+    smpte_noise.write_wav(str(fullPath), duration=20, channels=channels, config=config)
+
+    loop = loopPath.read_bytes()
+    assert loop[:4] == b"RIFF" and loop[8:12] == b"WAVE"
+    assert struct.unpack_from("<I", loop, 4)[0] == len(loop) - 8
+
+    chunks = read_chunks(loop)
+    periodLength = config.samplesPerPeriod * smpte_noise.sampleSize * channels
+    with open(str(fullPath), "rb") as reader:
+        info = smpte_noise.read_wave_info(reader)
+    fullData = fullPath.read_bytes()[info.dataOffset:]
+    assert len(chunks[b"data"]) == periodLength
+    assert chunks[b"data"] == fullData[:periodLength]
+
+    cues, cueId, position, chunkId, chunkStart, blockStart, sampleOffset = \
+        struct.unpack("<III4sIII", chunks[b"cue "])
+    assert (cues, position, chunkId, sampleOffset) == (1, 0, b"data", 0)
+
+    smpl = chunks[b"smpl"]
+    assert struct.unpack_from("<I", smpl, 8)[0] == 1000000000 // config.SampleRate
+    assert struct.unpack_from("<I", smpl, 28)[0] == 1   # number of loops
+    loopCue, loopType, start, end, fraction, playCount = struct.unpack_from("<IIIIII", smpl, 36)
+    assert (loopCue, loopType, start, playCount) == (cueId, 0, 0, 0)
+    assert end == config.samplesPerPeriod - 1
@@ -0,0 +1,15 @@
+#
+# Every bit-exact engine must reproduce the reference loop byte for byte.
+#
+
+import pytest
+
+import smpte_noise
+
+ENGINES = [engine for engine in ("fast", "stream", "numpy") if engine in smpte_noise.ENGINES]
+
+
+@pytest.mark.parametrize("sample_rate", [48000, 96000])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_matches_reference(engine, sample_rate):
+    assert smpte_noise.parity_check(engine, sample_rate) == 0